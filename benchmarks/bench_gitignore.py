@@ -0,0 +1,66 @@
+"""Compare the compiled gitignore engine against the former loop of PurePath.match
+calls over prefixed globs. Run with `python -m benchmarks.bench_gitignore`. Both
+only agree on patterns anchored to their folder: a prefixed absolute glob like
+/repo/*.pyc only matches files directly in /repo, while the gitignore pattern *.pyc
+matches at any depth. So the patterns here all have a slash, and both are checked
+to ignore the same paths before being timed"""
+import random
+import time
+from pathlib import Path
+
+from motllo.gitignore import GitIgnore
+from motllo.traverser import matches_glob
+
+ROOT = "/repo"
+PATTERNS = [
+    f"sub{sub}/{pattern}"
+    for sub in [0, 5]
+    for pattern in ["*.pyc", "*.log", "build", "*.so"]
+]
+
+
+def synthetic(folders=20, paths=5000, seed=0):
+    """Nested gitignores with the same patterns, and paths below them"""
+    rng = random.Random(seed)
+    bases = [ROOT] + [f"{ROOT}/pkg{idx}" for idx in range(folders - 1)]
+    names = ["main.py", "main.pyc", "app.log", "build", "lib.so", "README.md"]
+    all_paths = [
+        f"{rng.choice(bases)}/sub{rng.randint(0, 9)}/{rng.choice(names)}"
+        for _ in range(paths)
+    ]
+    return bases, all_paths
+
+
+def bench_loop(bases, paths):
+    globs = [f"{base}/{pattern}" for base in bases for pattern in PATTERNS]
+    as_paths = [Path(path) for path in paths]
+    start = time.perf_counter()
+    ignored = [str(path) for path in as_paths if matches_glob(path, globs)]
+    return time.perf_counter() - start, ignored
+
+
+def bench_compiled(bases, paths):
+    rules = GitIgnore()
+    for base in bases:
+        rules.add(base, PATTERNS)
+    start = time.perf_counter()
+    ignored = [path for path in paths if rules.ignored(path, False)]
+    return time.perf_counter() - start, ignored
+
+
+def main():
+    for folders in [1, 10, 50]:
+        bases, paths = synthetic(folders=folders)
+        loop, loop_ignored = bench_loop(bases, paths)
+        compiled, compiled_ignored = bench_compiled(bases, paths)
+        assert loop_ignored == compiled_ignored
+        print(
+            f"{folders:>3} gitignores, {len(paths)} paths: "
+            f"{len(loop_ignored)} ignored, "
+            f"loop {loop:.3f}s, compiled {compiled:.3f}s, "
+            f"{loop / compiled:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+"""Compare materialising templates with the former per line writer against the
+batched one: 10k short files, where opening files dominates both, and 100 long
+ones, where the per line writes do. Run with
+`python -m benchmarks.bench_materialise`. Each time is the best of RUNS, as writing
+to disk is noisy. The call counts are the filesystem calls each approach makes: the
+former one stats each file before opening it and writes every line and newline
+separately"""
+import logging
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from motllo.build import materialise_structure
+from motllo.ops import File, Folder
+
+RUNS = 5
+
+
+def synthetic(folders=100, files=100, lines=50):
+    """folders folders of files files each, with lines lines of contents"""
+    contents = "\n".join(f"line = {idx}" for idx in range(lines))
+    return Folder(
+        "",
+        [
+            Folder(
+                f"folder{folder}",
+                [
+                    File(f"file{idx}.py", basename=f"folder{folder}").set_contents(
+                        contents
+                    )
+                    for idx in range(files)
+                ],
+                depth=1,
+            )
+            for folder in range(folders)
+        ],
+    )
+
+
+def legacy_materialise(structure, path):
+    """The former writer, without logging and replacements"""
+    (path / Path(structure.as_posix())).mkdir()
+    for item in structure.iterdir():
+        if item.is_dir():
+            legacy_materialise(item, path)
+        else:
+            location = path / Path(item.as_posix())
+            if location.exists():
+                sys.exit(-1)
+            with location.open("w") as destination:
+                for line in item.contents:
+                    destination.write(line)
+                    destination.write("\n")
+
+
+def timed(function, structure):
+    best = None
+    for _ in range(RUNS):
+        destination = Path(tempfile.mkdtemp()) / "out"
+        start = time.perf_counter()
+        function(structure, destination)
+        elapsed = time.perf_counter() - start
+        shutil.rmtree(destination.parent)
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    for shape in [(100, 100, 50), (10, 10, 10000)]:
+        structure = synthetic(*shape)
+        folders = len(structure.iterdir()) + 1
+        files = sum(len(folder.iterdir()) for folder in structure.iterdir())
+        lines = sum(
+            len(item.contents)
+            for folder in structure.iterdir()
+            for item in folder.iterdir()
+        )
+        legacy = timed(legacy_materialise, structure)
+        batched = timed(
+            lambda structure, path: materialise_structure(
+                structure, path, dry_run=False
+            ),
+            structure,
+        )
+        print(f"{files} files of {lines // files} lines")
+        print(
+            f"  legacy: {legacy:.3f}s, {folders} mkdir, {files} stat, {files} open, "
+            f"{2 * lines} write"
+        )
+        print(
+            f"  batched: {batched:.3f}s, {folders} mkdir, {files} open, "
+            f"{files} write, {legacy / batched:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
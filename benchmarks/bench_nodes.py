@@ -0,0 +1,51 @@
+"""Memory taken by the nodes of a large traversal, measured with tracemalloc. Run
+with `python -m benchmarks.bench_nodes`. A temporary tree of small files is walked
+(without reading it) and the memory still traced once the structure is built is
+reported, per file. Contents are then loaded to see what they add"""
+import logging
+import shutil
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+from motllo.traverser import Traverser
+
+
+def synthetic(root: Path, folders=1000, files=50):
+    """folders folders of files small files each, in groups of 100 folders"""
+    for folder in range(folders):
+        location = root / f"group{folder // 100}" / f"folder{folder}"
+        location.mkdir(parents=True)
+        for idx in range(files):
+            (location / f"file{idx}.py").write_text("value = 1\n" * 5)
+    return folders * files
+
+
+def walk(folder):
+    for item in folder.iterdir():
+        if item.is_dir():
+            yield from walk(item)
+        else:
+            yield item
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    root = Path(tempfile.mkdtemp())
+    try:
+        files = synthetic(root / "tree")
+        tracemalloc.start()
+        structure = Traverser()(root / "tree")
+        listed = tracemalloc.get_traced_memory()[0]
+        for item in walk(structure):
+            item.text
+        loaded = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+    finally:
+        shutil.rmtree(root)
+    print(f"listed: {listed / 2 ** 20:.1f} MiB, {listed / files:.0f} bytes per file")
+    print(f"loaded: {loaded / 2 ** 20:.1f} MiB, {loaded / files:.0f} bytes per file")
+
+
+if __name__ == "__main__":
+    main()
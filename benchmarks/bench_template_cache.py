@@ -0,0 +1,49 @@
+"""Time building the structure of the same template many times with different
+replacements, parsing it every time against reusing its definitions from the
+in-memory and the pickled tiers of the template cache. Run with
+`python -m benchmarks.bench_template_cache`"""
+import logging
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.harness import generate_template
+
+from motllo.build import process_markdown
+from motllo.template_cache import TemplateCache
+
+REQUESTS = 20
+
+
+def timed(template: Path, new_cache) -> float:
+    start = time.perf_counter()
+    for request in range(REQUESTS):
+        replacements = {f"key{idx}": f"value{request}" for idx in range(5)}
+        process_markdown(template, replacements, cache=new_cache())
+    return time.perf_counter() - start
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    workdir = Path(tempfile.mkdtemp())
+    try:
+        template = workdir / "template.md"
+        template.write_text(generate_template(2000, 3, 40, 2, 5))
+        memory = TemplateCache()
+        parsed = timed(template, lambda: None)
+        in_memory = timed(template, lambda: memory)
+        # A new cache per request, as separate processes sharing the folder would
+        pickled = timed(template, lambda: TemplateCache(directory=workdir / "cache"))
+    finally:
+        shutil.rmtree(workdir)
+    for name, seconds in [
+        ("parsed", parsed),
+        ("in memory", in_memory),
+        ("pickled", pickled),
+    ]:
+        print(f"{name:<12}{seconds / REQUESTS * 1000:>10.1f}ms per request")
+
+
+if __name__ == "__main__":
+    main()
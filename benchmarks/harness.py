@@ -0,0 +1,307 @@
+"""Benchmark harness: generates a synthetic source tree and a synthetic template,
+times the main stages of motllo on them and writes the results as JSON, so runs on
+different commits can be compared. Everything is generated locally, with a seed.
+The benchmarks are a package run as modules from the root of the repository, so
+motllo and this harness import the same way for all of them:
+
+    python -m benchmarks.harness --files 2000 -o before.json
+    python -m benchmarks.harness --files 2000 -o after.json --compare before.json
+    python -m benchmarks.bench_template_cache
+
+build_tree only lists the tree, file contents are read lazily when build_markdown
+needs them, so reading is timed as part of build_markdown"""
+import json
+import logging
+import math
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+import click
+
+from motllo.build import _process_markdown, materialise_structure
+from motllo.gitignore import GitIgnore
+from motllo.markdown import build_markdown, build_tree
+from motllo.markdown_parser import MARKDOWN_PARSER
+from motllo.ops import File, Folder, tree
+from motllo.tree_parser import TreeParser
+
+IGNORED_PATTERNS = ["*.log", "build/"]
+
+
+def folder_paths(files: int, depth: int, files_per_folder: int = 10) -> List[str]:
+    """Relative folder of each file, spreading them over a balanced hierarchy of
+the given depth"""
+    folders = max(1, files // files_per_folder)
+    if depth < 1:
+        return [""] * files
+    branching = max(2, math.ceil(folders ** (1 / depth)))
+    paths = []
+    for idx in range(files):
+        folder = idx % folders
+        parts = [
+            f"d{folder // branching ** level % branching}" for level in range(depth)
+        ]
+        paths += ["/".join(parts)]
+    return paths
+
+
+def file_paths(files: int, depth: int) -> List[str]:
+    return [
+        f"{folder}/file{idx}.py" if folder != "" else f"file{idx}.py"
+        for idx, folder in enumerate(folder_paths(files, depth))
+    ]
+
+
+def generate_source_tree(
+    root: Path,
+    files: int,
+    depth: int,
+    file_lines: int,
+    gitignore_density: float,
+    seed: int = 0,
+):
+    """Write a source tree of files under root. A gitignore_density fraction of
+the folders get a .gitignore, and a log file it ignores"""
+    rng = random.Random(seed)
+    folders = set()
+    for path in file_paths(files, depth):
+        target = root / path
+        if target.parent not in folders:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            folders.add(target.parent)
+            if rng.random() < gitignore_density:
+                (target.parent / ".gitignore").write_text("\n".join(IGNORED_PATTERNS))
+                (target.parent / "debug.log").write_text("ignored\n" * file_lines)
+        lines = [
+            f"value_{idx} = {rng.randint(0, 10 ** 6)}" for idx in range(file_lines)
+        ]
+        target.write_text("\n".join(lines) + "\n")
+
+
+def _as_structure(paths: List[str]) -> Folder:
+    """Folder hierarchy with the files at paths, to render its tree"""
+    nested: Dict[str, Any] = {}
+    for path in paths:
+        *parts, name = path.split("/")
+        level = nested
+        for part in parts:
+            level = level.setdefault(part, {})
+        level[name] = None
+
+    def build(name: str, level: Dict[str, Any], depth: int) -> Folder:
+        contents: List[Any] = []
+        for child, below in level.items():
+            if below is None:
+                contents += [File(child)]
+            else:
+                contents += [build(child, below, depth + 1)]
+        return Folder(name, contents, depth)
+
+    return build("", nested, 0)
+
+
+def generate_template(
+    files: int,
+    depth: int,
+    file_lines: int,
+    blocks: int,
+    replacement_keys: int,
+    seed: int = 0,
+) -> str:
+    """Markdown template for files, each with blocks code blocks of file_lines
+lines in total, interspersed with prose, using replacement_keys keys"""
+    rng = random.Random(seed)
+    paths = file_paths(files, depth)
+    markdown = ["# Tree structure", "", "```"]
+    markdown += list(tree(_as_structure(paths)))
+    markdown += ["```", ""]
+    keys = [f"key{idx}" for idx in range(replacement_keys)]
+    lines_per_block = max(1, file_lines // max(1, blocks))
+    for path in paths:
+        markdown += [f"# `{path}`", ""]
+        if len(keys) > 0:
+            markdown += ["### Replacements", ""]
+            markdown += [f"- `{key}`: `__{key.upper()}__`" for key in keys] + [""]
+        for block in range(blocks):
+            markdown += [f"Block {block} of {path}, explained.", "", "```python"]
+            for line in range(lines_per_block):
+                key = f"__{rng.choice(keys).upper()}__" if len(keys) > 0 else "x"
+                markdown += [f"value_{line} = {key}  # {rng.randint(0, 10 ** 6)}"]
+            markdown += ["```", ""]
+    return "\n".join(markdown)
+
+
+def measure(
+    function: Callable[[], Any],
+    repeats: int,
+    setup: Optional[Callable[[], Any]] = None,
+) -> Dict[str, Any]:
+    """Best and median wall time of function over repeats runs. setup runs before
+each of them, untimed, and its result is passed to function"""
+    timings = []
+    for _ in range(repeats):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        if setup is not None:
+            function(argument)
+        else:
+            function()
+        timings += [time.perf_counter() - start]
+    return {
+        "best": min(timings),
+        "median": statistics.median(timings),
+        "repeats": repeats,
+    }
+
+
+def commit() -> Optional[str]:
+    """Commit being benchmarked, if in a git checkout"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=Path(__file__).parent,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(params: Dict[str, Any], repeats: int, workdir: Path) -> Dict[str, Any]:
+    """Time each stage on data generated according to params"""
+    source = workdir / "source"
+    generate_source_tree(
+        source,
+        params["files"],
+        params["depth"],
+        params["file_lines"],
+        params["gitignore_density"],
+        params["seed"],
+    )
+    template = generate_template(
+        params["files"],
+        params["depth"],
+        params["file_lines"],
+        params["blocks"],
+        params["replacement_keys"],
+        params["seed"],
+    )
+    replacements = {
+        f"key{idx}": f"value{idx}" for idx in range(params["replacement_keys"])
+    }
+    tree_lines = [
+        line for line in template.split("```")[1].split("\n") if line.strip() != ""
+    ]
+
+    def traverse():
+        return build_tree(source, None, None, max_length=15, gitignore=GitIgnore())
+
+    outputs = iter(range(repeats))
+    results = {
+        "build_tree": measure(traverse, repeats),
+        "build_markdown": measure(
+            lambda structure: build_markdown(structure, 15), repeats, setup=traverse
+        ),
+        "parse": measure(lambda: MARKDOWN_PARSER.parse(template), repeats),
+        "tree_parser": measure(lambda: TreeParser(tree_lines)(), repeats),
+        "materialise_structure": measure(
+            lambda structure: materialise_structure(
+                structure,
+                workdir / f"output{next(outputs)}",
+                dry_run=False,
+                replacements=replacements,
+            ),
+            repeats,
+            setup=lambda: _process_markdown(template, replacements),
+        ),
+    }
+    return {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "params": params,
+        "template_bytes": len(template.encode()),
+        "results": results,
+    }
+
+
+def compare(previous: Dict[str, Any], current: Dict[str, Any]) -> List[str]:
+    """Ratio of best times of each stage, previous over current"""
+    lines = []
+    for name, result in current["results"].items():
+        if name not in previous["results"]:
+            continue
+        before = previous["results"][name]["best"]
+        lines += [
+            f"{name:<24}{before:>10.4f}s{result['best']:>10.4f}s"
+            f"{before / result['best']:>8.2f}x"
+        ]
+    return lines
+
+
+@click.command()
+@click.option("--files", type=int, default=1000, help="Files in the tree")
+@click.option("--depth", type=int, default=3, help="Folder nesting")
+@click.option("--file-lines", type=int, default=40, help="Lines per file")
+@click.option(
+    "--gitignore-density",
+    type=float,
+    default=0.1,
+    help="Fraction of folders with a .gitignore",
+)
+@click.option("--blocks", type=int, default=2, help="Code blocks per file section")
+@click.option(
+    "--replacement-keys", type=int, default=5, help="Replacement keys per file"
+)
+@click.option("--seed", type=int, default=0)
+@click.option("--repeats", type=int, default=3)
+@click.option("-o", "--output", help="Write the results as JSON to this file")
+@click.option("--compare", "previous", help="Results of a previous run to compare")
+def main(
+    files,
+    depth,
+    file_lines,
+    gitignore_density,
+    blocks,
+    replacement_keys,
+    seed,
+    repeats,
+    output,
+    previous,
+):
+    """Generate synthetic data, time each stage on it and report the results"""
+    logging.disable(logging.CRITICAL)
+    params = {
+        "files": files,
+        "depth": depth,
+        "file_lines": file_lines,
+        "gitignore_density": gitignore_density,
+        "blocks": blocks,
+        "replacement_keys": replacement_keys,
+        "seed": seed,
+    }
+    workdir = Path(tempfile.mkdtemp(prefix="motllo-bench-"))
+    try:
+        results = run(params, repeats, workdir)
+    finally:
+        shutil.rmtree(workdir)
+    if output is not None:
+        with open(output, "w") as destination:
+            json.dump(results, destination, indent=2)
+    else:
+        click.echo(json.dumps(results, indent=2))
+    if previous is not None:
+        with open(previous) as stored:
+            for line in compare(json.load(stored), results):
+                click.echo(line)
+
+
+if __name__ == "__main__":
+    main()
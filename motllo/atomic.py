@@ -0,0 +1,56 @@
+import os
+import shutil
+import uuid
+from typing import Union
+
+
+def staging_name(location: str) -> str:
+    """Hidden sibling of location, unique to each call"""
+    parent, name = os.path.split(location)
+    return os.path.join(parent, f".{name}.motllo-{uuid.uuid4().hex[:12]}")
+
+
+def _stage(location: str, data: Union[str, bytes]) -> str:
+    """Write data to a new staging file next to location, and return its name"""
+    staging = staging_name(location)
+    try:
+        if isinstance(data, bytes):
+            with open(staging, "wb") as binary:
+                binary.write(data)
+        else:
+            with open(staging, "w") as text:
+                text.write(data)
+    except BaseException:
+        if os.path.exists(staging):
+            os.remove(staging)
+        raise
+    return staging
+
+
+def write_atomically(location: str, data: Union[str, bytes]):
+    """Write data next to location, then move it into place in one step, so location
+is either as it was or fully written. Each call stages into its own file, so
+concurrent writers never share one. The mode of an existing location is kept"""
+    staging = _stage(location, data)
+    try:
+        try:
+            shutil.copymode(location, staging)
+        except FileNotFoundError:
+            pass
+        os.replace(staging, location)
+    except BaseException:
+        os.remove(staging)
+        raise
+
+
+def create_atomically(location: str, data: Union[str, bytes]) -> bool:
+    """Like write_atomically, but False, leaving location untouched, if it already
+exists. The staging file is linked into place, which fails rather than replace"""
+    staging = _stage(location, data)
+    try:
+        os.link(staging, location)
+    except FileExistsError:
+        return False
+    finally:
+        os.remove(staging)
+    return True
@@ -1,48 +1,128 @@
 import logging
+import os
+import shutil
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
 
+from motllo.atomic import create_atomically, staging_name, write_atomically
+from motllo.manifest import (BuildReport, Manifest, content_hash, file_entry,
+                             load_manifest, same_stat, save_manifest)
 from motllo.markdown_parser import (MARKDOWN_PARSER, BareCodeBlock, CodeBlock,
                                     HeadingBlock, ListBlock)
-from motllo.ops import Folder
+from motllo.ops import File, Folder
+from motllo.profiling import PROFILER, phase
+from motllo.replacer import compile_replacer
+from motllo.template_cache import Definitions, TemplateCache
 from motllo.tree_parser import TreeParser
 
 logger = logging.getLogger("motllo.read_markdown")
 
 TREE_KEY = "Markdown Tree Structure"
 
+CREATED = "created"
+UPDATED = "updated"
+UNCHANGED = "unchanged"
+ORPHANED = "orphaned"
 
-def structure_filler(folder, file_contents, file_replacements):
-    """Populate a folder tree structure with file contents"""
+
+def normalise_marker(path: str) -> str:
+    """Section name or tree path of a file, without any ./ in it"""
+    return "/".join(part for part in path.split("/") if part != ".")
+
+
+def _timed(blocks):
+    """Blocks along with the time spent parsing each of them"""
+    iterator = iter(blocks)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        yield item, time.perf_counter() - start
+
+
+def _files(folder: Folder, files: List[File]) -> List[File]:
+    """Add all files below folder to files, in tree order"""
     for item in folder.iterdir():
         if item.is_dir():
-            structure_filler(item, file_contents, file_replacements)
+            _files(item, files)
         else:
-            if item.as_posix().startswith("/."):
-                cleaned = item.as_posix().replace("/./", "/")
-            else:
-                cleaned = item.as_posix()
-            if cleaned not in file_contents.keys():
-                raise Exception(f"Damn file not there {cleaned}")
-            item.set_contents(file_contents[cleaned])
-            if cleaned not in file_replacements:
-                logger.debug("No replacements found for marker %s", cleaned)
-            else:
-                item.set_replacements(file_replacements[cleaned])
+            files += [item]
+    return files
+
+
+def reconcile(folder: Folder, file_contents: Dict[Optional[str], str]):
+    """Match the files of the tree with the sections of the document, by their
+normalised paths. Returns the files along with their section name, the paths of
+files without a section, the names of sections without a file and the pairs of
+sections for the same path, where the later one is used"""
+    index: Dict[str, str] = {}
+    duplicates = []
+    for marker in file_contents:
+        if marker is None or marker == TREE_KEY:
+            continue
+        path = normalise_marker(marker)
+        if path in index:
+            duplicates += [(index[path], marker)]
+        index[path] = marker
+    matched = []
+    missing = []
+    claimed = set()
+    for item in _files(folder, []):
+        path = normalise_marker(item.as_posix())
+        if path in index:
+            matched += [(item, index[path])]
+            claimed.add(path)
+        else:
+            missing += [path]
+    orphans = [marker for path, marker in index.items() if path not in claimed]
+    return matched, missing, orphans, duplicates
+
+
+def structure_filler(folder, file_contents, file_replacements):
+    """Populate a folder tree structure with file contents. All files without a
+section are reported at once, before anything is filled"""
+    matched, missing, orphans, duplicates = reconcile(folder, file_contents)
+    for marker in orphans:
+        logger.warning("Section `%s` is not a file in the tree, ignoring it", marker)
+    for earlier, later in duplicates:
+        logger.warning(
+            "Sections `%s` and `%s` are the same file, ignoring the first",
+            earlier,
+            later,
+        )
+    if len(missing) > 0:
+        for path in missing:
+            logger.error("File %s in the tree has no section in the document", path)
+        raise Exception(
+            f"{len(missing)} files in the tree have no section: {', '.join(missing)}"
+        )
+    for item, marker in matched:
+        item.set_contents(file_contents[marker])
+        if marker not in file_replacements:
+            logger.debug("No replacements found for marker %s", marker)
+        else:
+            item.set_replacements(file_replacements[marker])
 
 
 def replace_replacements(file_replacement, replacements, to_be_replaced):
-    """Apply replacements to file identifier"""
-    replaced = to_be_replaced
-    common_keys = [key for key in file_replacement if key in replacements]
-    for key in common_keys:
-        old_value = file_replacement[key]
-        new_value = replacements[key]
-        replaced = replaced.replace(old_value, new_value)
-    return replaced
+    """Apply replacements to file identifier, in a single scan (see
+compile_replacer)"""
+    pairs = tuple(
+        (old_value, replacements[key])
+        for key, old_value in file_replacement.items()
+        if key in replacements
+    )
+    return compile_replacer(pairs)(to_be_replaced)
 
 
-def replace_file_contents(replacements, file_contents, file_replacements):
+def replace_file_contents(
+    replacements, file_contents, file_replacements, report: Optional[BuildReport] = None
+):
     """Modify tree structure according to the replacements provided"""
     replaced_file_contents = {}
     for marker in file_contents:
@@ -59,6 +139,10 @@ def replace_file_contents(replacements, file_contents, file_replacements):
                 logger.info(
                     "Replaced file reference `%s` with `%s`", marker, new_file_marker
                 )
+                if report is not None:
+                    report.rename(
+                        normalise_marker(marker), normalise_marker(new_file_marker)
+                    )
             replaced_file_contents[new_file_marker] = contents
         else:
             replaced_file_contents[marker] = contents
@@ -73,14 +157,26 @@ def _is_heading_block(item, with_title=None):
     return isinstance(item, HeadingBlock)
 
 
-def process_markdown_definitions(markdown, replacements):
-    """Process markdown, finding replacements needed"""
+def process_markdown_definitions(
+    markdown, replacements, report: Optional[BuildReport] = None
+):
+    """Process markdown, finding replacements needed. With a report, the time spent
+parsing each section is recorded for its file"""
+    definitions = markdown_definitions(markdown, report)
+    warn_missing_replacements(definitions, replacements)
+    return definitions.file_contents, definitions.file_replacements
+
+
+def markdown_definitions(markdown, report: Optional[BuildReport] = None) -> Definitions:
+    """Contents and replacement rules of each section, and the replacement keys
+used, which do not depend on the replacements given"""
     file_marker = None
     replacement_marker = None
-    file_contents = {}
-    file_replacements = {}
+    file_contents: Dict[Optional[str], str] = {}
+    file_replacements: Dict[Optional[str], Dict[str, str]] = {}
     required_keys = {}
-    for item in markdown:
+    for item, seconds in _timed(markdown):
+        PROFILER.add("markdown parsing", seconds)
         if _is_heading_block(item):
             if _is_heading_block(item, with_title="tree structure"):
                 file_marker = TREE_KEY
@@ -89,9 +185,11 @@ def process_markdown_definitions(markdown, replacements):
             else:
                 filename = item.text.strip()
                 file_marker = filename.replace("`", "")
-        elif isinstance(item, ListBlock) and replacement_marker is not None:
-            if ":" not in item.text:
-                continue
+        elif (
+            isinstance(item, ListBlock)
+            and replacement_marker is not None
+            and ":" in item.text
+        ):
             logger.info(
                 "Found a replacement block %s for section `%s`",
                 item.text,
@@ -113,23 +211,44 @@ def process_markdown_definitions(markdown, replacements):
                 file_contents[file_marker] = contents
             else:
                 file_contents[file_marker] += "\n\n" + contents
-    for key in required_keys:
+        if report is not None:
+            section = None
+            if file_marker is not None and file_marker != TREE_KEY:
+                section = normalise_marker(file_marker)
+            report.add_time(section, "parse", seconds)
+    return Definitions(file_contents, file_replacements, list(required_keys))
+
+
+def warn_missing_replacements(definitions: Definitions, replacements):
+    for key in definitions.required_keys:
         if key not in replacements:
             logger.warning(
                 "You have provided no replacement for `%s` in the CLI (use the -r flag)",
                 key,
             )
-    return file_contents, file_replacements
 
 
-def parse_markdown_to_structure(markdown, replacements):
+def parse_markdown_to_structure(
+    markdown, replacements, report: Optional[BuildReport] = None
+):
     """Convert a parsed Markdown document into a folder structure"""
-    file_contents, file_replacements = process_markdown_definitions(
-        markdown, replacements
-    )
+    # Blocks are parsed as they are consumed, so definitions include parsing
+    with phase("definitions") as counted:
+        definitions = markdown_definitions(markdown, report)
+        counted.add(len(definitions.file_contents))
+    return definitions_to_structure(definitions, replacements, report)
 
+
+def definitions_to_structure(
+    definitions: Definitions, replacements, report: Optional[BuildReport] = None
+):
+    """Folder structure of the definitions of a document, once the replacements
+are applied. The definitions are not modified, so they can be reused"""
+    warn_missing_replacements(definitions, replacements)
+    file_contents = definitions.file_contents
+    file_replacements = definitions.file_replacements
     replaced_file_contents = replace_file_contents(
-        replacements, file_contents, file_replacements
+        replacements, file_contents, file_replacements, report
     )
 
     if TREE_KEY not in replaced_file_contents:
@@ -155,85 +274,322 @@ def parse_markdown_to_structure(markdown, replacements):
     else:
         replaced_tree = tree_lines
         replaced_file_replacements = file_replacements
-    try:
-        structure = TreeParser(replaced_tree)()
-    except IndexError as idx:
-        logger.error("Failed processing the tree. Tree looks like:")
-        for line in replaced_tree:
-            logger.error(line)
-        logger.warning(
-            "Please make sure your tree has no additional spaces, spacing is important. Full exception follows"
-        )
-        logger.warning(idx, exc_info=True)
-        sys.exit(-1)
+    start = time.perf_counter()
+    with phase("tree parsing") as tree_parsing:
+        try:
+            structure = TreeParser(replaced_tree)()
+        except IndexError as idx:
+            logger.error("Failed processing the tree. Tree looks like:")
+            for line in replaced_tree:
+                logger.error(line)
+            logger.warning(
+                "Please make sure your tree has no additional spaces, spacing is important. Full exception follows"
+            )
+            logger.warning(idx, exc_info=True)
+            sys.exit(-1)
+        tree_parsing.add(len(replaced_tree))
+    if report is not None:
+        report.add_time(None, "parse", time.perf_counter() - start)
     logger.debug(replaced_file_replacements)
-    structure_filler(structure, replaced_file_contents, replaced_file_replacements)
+    with phase("structure filling") as filling:
+        structure_filler(structure, replaced_file_contents, replaced_file_replacements)
+        filling.add(len(replaced_file_contents))
     return structure
 
 
-def process_markdown(path: Path, replacements):
-    """Convert markdown into a structure"""
+def process_markdown(
+    path: Path,
+    replacements,
+    report: Optional[BuildReport] = None,
+    cache: Optional[TemplateCache] = None,
+):
+    """Convert markdown into a structure. Blocks are streamed out of the file as
+they are parsed, the document is never held in memory as a whole. With a cache,
+the definitions of a template that did not change since it was last parsed are
+reused, and only the replacements are applied"""
+    if cache is not None:
+        key = cache.path_key(path)
+        definitions = cache.get(key)
+        if definitions is not None:
+            return definitions_to_structure(definitions, replacements, report)
     with open(path) as markdown_path:
-        all_lines = markdown_path.read()
-    return _process_markdown(all_lines, replacements)
+        markdown = MARKDOWN_PARSER.parse_stream(markdown_path)
+        with phase("definitions") as counted:
+            definitions = markdown_definitions(markdown, report)
+            counted.add(len(definitions.file_contents))
+    if cache is not None:
+        cache.put(key, definitions)
+    return definitions_to_structure(definitions, replacements, report)
 
 
-def _process_markdown(all_lines, replacements):
+def _process_markdown(all_lines, replacements, cache: Optional[TemplateCache] = None):
+    if cache is not None:
+        key = cache.text_key(all_lines)
+        definitions = cache.get(key)
+        if definitions is None:
+            markdown, _ = MARKDOWN_PARSER.parse(all_lines)
+            definitions = markdown_definitions(markdown)
+            cache.put(key, definitions)
+        return definitions_to_structure(definitions, replacements)
     markdown, _ = MARKDOWN_PARSER.parse(all_lines)
     return parse_markdown_to_structure(markdown, replacements)
 
 
-def materialise_structure(
+def _plan_structure(
     structure: Folder,
-    path: Path,
-    dry_run=True,
-    replacements=None,
-    ignore_existing_folders=False,
+    path: str,
+    replacements,
+    folders,
+    files,
+    report: Optional[BuildReport] = None,
 ):
-    """Materialise or dry run the folder structure"""
-    logger.debug("Replacements: %s", replacements)
-    location = path / Path(structure.as_posix())
+    """Walk the structure logging what is to be created and applying replacements.
+Folders and files are collected in creation order, as path strings"""
+    location = os.path.normpath(os.path.join(path, structure.as_posix()))
     logger.info("🗃  %s", location)
-    if not dry_run:
-        try:
-            location.mkdir()
-        except FileExistsError:
-            if ignore_existing_folders:
-                logger.warning(
-                    "Folder %s already exists and will not be recreated", location
-                )
-            else:
-                logger.error(
-                    "The destination folder %s already exists. Either delete it, use a new path or pass the --ignore-existing-folders flag",
-                    location,
-                )
-                sys.exit(-1)
-
+    folders += [location]
     for item in structure.iterdir():
         if item.is_dir():
-            materialise_structure(item, path, dry_run, replacements)
+            _plan_structure(item, path, replacements, folders, files, report)
         else:
-            location = path / Path(item.as_posix())
+            location = os.path.normpath(os.path.join(path, item.as_posix()))
 
+            text = item.text
             logger.info(
-                "📁 %s (%s characters)", location, len("".join(item.contents)),
+                "📁 %s (%s characters)", location, len(text) - text.count("\n"),
             )
+            keys = []
             if replacements is not None and item.replacements is not None:
-                new_contents = []
-                for line in item.contents:
-                    new_contents += [
-                        replace_replacements(item.replacements, replacements, line)
-                    ]
-                item.set_contents("\n".join(new_contents))
+                start = time.perf_counter()
+                # Keys never span lines, so the whole file is replaced at once
+                item.set_contents(
+                    replace_replacements(item.replacements, replacements, text)
+                )
+                keys = [key for key in item.replacements if key in replacements]
+                if report is not None:
+                    elapsed = time.perf_counter() - start
+                    marker = normalise_marker(item.as_posix())
+                    report.add_time(marker, "replace", elapsed)
                 logger.info("Replacements applied to %s", item.name)
-            if not dry_run:
-                if location.exists():
-                    logger.error(
-                        "File %s already exists at that location. Delete it first",
-                        location,
-                    )
-                    sys.exit(-1)
-                with location.open("w") as destination:
-                    for line in item.contents:
-                        destination.write(line)
-                        destination.write("\n")
+                text = item.text
+            if report is not None:
+                marker = normalise_marker(item.as_posix())
+                report.planned(marker, location, _render(text), keys)
+            files += [(location, text)]
+
+
+def _render(text: str) -> str:
+    """What is written for a file"""
+    return text + "\n"
+
+
+def _run(function, arguments, jobs=1) -> list:
+    """Call function with each tuple of arguments, from a pool of jobs threads if
+more than one. Results are in the order of the arguments"""
+    if jobs > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            return list(pool.map(lambda args: function(*args), arguments))
+    return [function(*args) for args in arguments]
+
+
+def _write_file(location: str, text: str) -> bool:
+    """Write a file with a single call, False if it already exists. Opening in
+exclusive mode fails for existing files without checking for them first"""
+    try:
+        destination = open(location, "x")
+    except FileExistsError:
+        return False
+    with destination:
+        destination.write(_render(text))
+    return True
+
+
+def _replace_file(location: str, text: str) -> bool:
+    """Write a file next to location, then move it into place in one step"""
+    write_atomically(location, _render(text))
+    return True
+
+
+def _create_file(location: str, text: str) -> bool:
+    """Write a file next to location, then link it into place in one step, False if
+it already exists"""
+    return create_atomically(location, _render(text))
+
+
+def _write_files(files, writer, jobs=1, report: Optional[BuildReport] = None):
+    """Write all files, from a pool of jobs threads if more than one. Files that
+already exist are all reported, in creation order whatever the order of the writes"""
+    if report is not None:
+        writer = report.timed_writer(writer)
+    written = _run(writer, files, jobs)
+    existing = [location for (location, _), ok in zip(files, written) if not ok]
+    for location in existing:
+        logger.error(
+            "File %s already exists at that location. Delete it first", location,
+        )
+    if len(existing) > 0:
+        sys.exit(-1)
+
+
+def _commit_staged(folders, files, jobs=1, report: Optional[BuildReport] = None):
+    """Materialise into a hidden sibling of the destination, renamed into place once
+complete: the destination appears all at once, and nothing is left behind on
+failure"""
+    location = folders[0]
+    staging = staging_name(location)
+
+    def staged(target: str) -> str:
+        return staging + target[len(location) :]
+
+    os.mkdir(staging)
+    try:
+        for folder in folders[1:]:
+            os.mkdir(staged(folder))
+        staged_files = [(staged(target), text) for target, text in files]
+        if report is not None:
+            for target, _ in files:
+                report.moved(target, staged(target))
+        _write_files(staged_files, _write_file, jobs, report)
+        os.rename(staging, location)
+    except OSError as exc:
+        shutil.rmtree(staging, ignore_errors=True)
+        logger.error("Could not materialise %s: %s", location, exc)
+        sys.exit(-1)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+
+def _commit_merged(folders, files, jobs=1, report: Optional[BuildReport] = None):
+    """Materialise into an existing destination. Existing files are all reported
+before anything is written, and each file is created atomically so it is never
+seen half written. A file appearing in the meantime is reported, not replaced"""
+    existing = [location for location, _ in files if os.path.lexists(location)]
+    for location in existing:
+        logger.error(
+            "File %s already exists at that location. Delete it first", location,
+        )
+    if len(existing) > 0:
+        sys.exit(-1)
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
+    _write_files(files, _create_file, jobs, report)
+
+
+def _sync_file(location: str, text: str, recorded: Optional[Dict[str, Any]]):
+    """Write a file only if its contents changed. A file that still has the size
+and modification time recorded in the manifest is not even read. Returns what was
+done and the new manifest entry"""
+    rendered = _render(text)
+    digest = content_hash(rendered.encode())
+    try:
+        stat: Optional[os.stat_result] = os.stat(location)
+    except FileNotFoundError:
+        stat = None
+    if stat is not None:
+        if recorded is not None and same_stat(recorded, stat):
+            current = recorded["hash"]
+        else:
+            with open(location, "rb") as existing:
+                current = content_hash(existing.read())
+        if current == digest:
+            return UNCHANGED, file_entry(digest, location)
+    _replace_file(location, text)
+    return CREATED if stat is None else UPDATED, file_entry(digest, location)
+
+
+def _commit_incremental(
+    folders, files, jobs=1, report: Optional[BuildReport] = None
+) -> Dict[str, int]:
+    """Materialise into a destination that may exist, only writing files whose
+contents changed. A manifest of hashes is kept in the destination. Files in the
+previous manifest that are not built anymore are reported as orphaned, and kept"""
+    location = folders[0]
+
+    def relative(target: str) -> str:
+        return os.path.relpath(target, location).replace(os.sep, "/")
+
+    if not os.path.lexists(location):
+        _commit_staged(folders, files, jobs, report)
+        previous: Manifest = {}
+        synced = [
+            (CREATED, file_entry(content_hash(_render(text).encode()), target))
+            for target, text in files
+        ]
+    else:
+        previous = load_manifest(location)
+        for folder in folders:
+            os.makedirs(folder, exist_ok=True)
+        sync = _sync_file if report is None else report.timed_writer(_sync_file)
+        synced = _run(
+            sync,
+            [
+                (target, text, previous.get(relative(target)))
+                for target, text in files
+            ],
+            jobs,
+        )
+    counts = {CREATED: 0, UPDATED: 0, UNCHANGED: 0, ORPHANED: 0}
+    manifest: Manifest = {}
+    for (target, _), (status, entry) in zip(files, synced):
+        counts[status] += 1
+        manifest[relative(target)] = entry
+    for name, entry in previous.items():
+        if name not in manifest and os.path.lexists(os.path.join(location, name)):
+            logger.warning("File %s is not in the template anymore", name)
+            counts[ORPHANED] += 1
+            manifest[name] = entry
+    save_manifest(location, manifest)
+    logger.info(
+        "%s created, %s updated, %s unchanged, %s orphaned",
+        counts[CREATED],
+        counts[UPDATED],
+        counts[UNCHANGED],
+        counts[ORPHANED],
+    )
+    return counts
+
+
+def materialise_structure(
+    structure: Folder,
+    path: Path,
+    dry_run=True,
+    replacements=None,
+    ignore_existing_folders=False,
+    jobs=1,
+    incremental=False,
+    report: Optional[BuildReport] = None,
+):
+    """Materialise or dry run the folder structure. The whole structure is planned
+first, then materialised in a staging folder renamed into place at the end. Files
+are written concurrently with more than one job. With ignore_existing_folders, an
+existing destination is merged into, file by file. With incremental, only files
+that changed are written, and the counts of created, updated, unchanged and
+orphaned files are returned. With a report, what is built and how long it takes is
+recorded in it"""
+    logger.debug("Replacements: %s", replacements)
+    folders: List[str] = []
+    files: List[Tuple[str, str]] = []
+    with phase("planning") as planning:
+        _plan_structure(structure, str(path), replacements, folders, files, report)
+        planning.add(len(files))
+    if dry_run:
+        return None
+    with phase("writing") as writing:
+        writing.add(len(files))
+        if incremental:
+            return _commit_incremental(folders, files, jobs, report)
+        location = folders[0]
+        if not os.path.lexists(location):
+            _commit_staged(folders, files, jobs, report)
+        elif ignore_existing_folders:
+            logger.warning(
+                "Folder %s already exists and will not be recreated", location
+            )
+            _commit_merged(folders, files, jobs, report)
+        else:
+            logger.error(
+                "The destination folder %s already exists. Either delete it, use a new path or pass the --ignore-existing-folders flag",
+                location,
+            )
+            sys.exit(-1)
@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Union
+
+logger = logging.getLogger("motllo.cache")
+
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+CACHE_FILE = "traversal.sqlite"
+
+MISSING = object()
+
+
+def stamp(path: Union[str, Path]) -> str:
+    """What identifies a version of a file or folder: mtime, size and inode"""
+    stat = os.stat(path)
+    return f"{stat.st_mtime_ns}:{stat.st_size}:{stat.st_ino}"
+
+
+class TraversalCache:
+    """On-disk cache of folder listings and file contents for the Traverser, in a
+SQLite file inside directory. Entries are keyed by kind and path, and only hit if
+the stamp (mtime, size, inode) of the path is still the same. Once the cache grows
+over max_bytes, the least recently used entries are evicted on close"""
+
+    def __init__(self, directory: Path, max_bytes: int = DEFAULT_MAX_BYTES):
+        directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._used: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            str(directory / CACHE_FILE), check_same_thread=False
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS entries "
+            "(key TEXT PRIMARY KEY, stamp TEXT, value TEXT, size INTEGER, used REAL)"
+        )
+
+    def get(self, key: str, path_stamp: str) -> Any:
+        """The cached value, or MISSING if absent or stale"""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT stamp, value FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or row[0] != path_stamp:
+                self.misses += 1
+                return MISSING
+            self.hits += 1
+            # Recency is written in one go on close
+            self._used[key] = time.time()
+        return json.loads(row[1])
+
+    def put(self, key: str, path_stamp: str, value: Any):
+        """Stores a JSON serialisable value"""
+        serialised = json.dumps(value)
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, path_stamp, serialised, len(serialised), time.time()),
+            )
+
+    def cached(self, kind: str, path: str, compute: Callable[[], Any]) -> Any:
+        """Value of compute for path, from the cache if path has not changed"""
+        try:
+            path_stamp = stamp(path)
+        except OSError:
+            return compute()
+        key = f"{kind}:{path}"
+        value = self.get(key, path_stamp)
+        if value is MISSING:
+            value = compute()
+            self.put(key, path_stamp, value)
+        return value
+
+    def close(self):
+        """Writes recency, evicts least recently used entries over max_bytes"""
+        with self._lock:
+            self._connection.executemany(
+                "UPDATE entries SET used = ? WHERE key = ?",
+                [(used, key) for key, used in self._used.items()],
+            )
+            total = self._connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM entries"
+            ).fetchone()[0]
+            if total > self.max_bytes:
+                evicted = 0
+                rows = self._connection.execute(
+                    "SELECT key, size FROM entries ORDER BY used, rowid"
+                ).fetchall()
+                for key, size in rows:
+                    if total <= self.max_bytes:
+                        break
+                    self._connection.execute(
+                        "DELETE FROM entries WHERE key = ?", (key,)
+                    )
+                    total -= size
+                    evicted += 1
+                logger.debug("Evicted %s cache entries", evicted)
+            self._connection.commit()
+            self._connection.close()
+        logger.debug("Traversal cache: %s hits, %s misses", self.hits, self.misses)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
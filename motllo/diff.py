@@ -0,0 +1,140 @@
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from motllo.build import process_markdown, replace_replacements
+from motllo.cache import TraversalCache
+from motllo.gitignore import GitIgnore
+from motllo.markdown import build_tree
+from motllo.ops import File, Folder
+from motllo.profiling import phase
+from motllo.template_cache import TemplateCache
+from motllo.traverser import BINARY_PLACEHOLDER, Traverser
+
+logger = logging.getLogger("motllo.diff")
+
+ADDED = "added"
+REMOVED = "removed"
+MODIFIED = "modified"
+
+# Kind of change and path of the file, relative to the compared folders
+Change = Tuple[str, str]
+
+
+def _files(node: Union[File, Folder], path: str) -> List[str]:
+    """Paths of all files at or below node"""
+    if isinstance(node, File):
+        return [path]
+    paths = []
+    pending = [(node, path)]
+    while pending:
+        folder, prefix = pending.pop()
+        for item in folder.iterdir():
+            location = f"{prefix}/{item.name}" if prefix != "" else item.name
+            if item.is_dir():
+                pending += [(item, location)]
+            else:
+                paths += [location]
+    return paths
+
+
+def diff_structures(template: Folder, actual: Folder) -> List[Change]:
+    """Files added to actual, removed from it or whose contents differ, with respect
+to template. The names of the two roots are not compared. Subtrees with the same
+Merkle hash are skipped without looking inside, and empty folders are ignored"""
+    changes: List[Change] = []
+    pending = [(template, actual, "")]
+    while pending:
+        expected, found, prefix = pending.pop()
+        expected_items: Dict[str, Union[File, Folder]] = {
+            i.name: i for i in expected.iterdir()
+        }
+        found_items: Dict[str, Union[File, Folder]] = {
+            i.name: i for i in found.iterdir()
+        }
+        for name, item in expected_items.items():
+            location = f"{prefix}/{name}" if prefix != "" else name
+            other = found_items.get(name)
+            if other is None:
+                changes += [(REMOVED, path) for path in _files(item, location)]
+            elif item.is_dir() != other.is_dir():
+                changes += [(REMOVED, path) for path in _files(item, location)]
+                changes += [(ADDED, path) for path in _files(other, location)]
+            elif item == other:
+                continue
+            elif isinstance(item, Folder) and isinstance(other, Folder):
+                pending += [(item, other, location)]
+            else:
+                changes += [(MODIFIED, location)]
+        for name, other in found_items.items():
+            if name not in expected_items:
+                location = f"{prefix}/{name}" if prefix != "" else name
+                changes += [(ADDED, path) for path in _files(other, location)]
+    return sorted(changes, key=lambda change: change[1])
+
+
+def _replace_contents(structure: Folder, replacements):
+    """Apply replacements to the contents of the files, as building does"""
+    pending = [structure]
+    while pending:
+        folder = pending.pop()
+        for item in folder.iterdir():
+            if item.is_dir():
+                pending += [item]
+            elif item.replacements is not None and item.text is not None:
+                item.set_contents(
+                    replace_replacements(item.replacements, replacements, item.text)
+                )
+
+
+def _listed(structure: Folder, path: str, traverser: Traverser) -> Folder:
+    """What of structure traversing it at path would list, so files a build creates
+but traversal leaves out (like a hidden .gitignore) are not reported as removed"""
+    contents: List[Union[File, Folder]] = []
+    for item in structure.iterdir():
+        location = os.path.join(path, item.name)
+        if not traverser.listed(item.name, location, item.is_dir()):
+            continue
+        if isinstance(item, Folder):
+            contents += [_listed(item, location, traverser)]
+        else:
+            contents += [item]
+    return Folder(structure.name, contents)
+
+
+def diff(
+    template: Path,
+    path: Path,
+    replacements,
+    ignore_globs: Optional[List[str]] = None,
+    include_globs: Optional[List[str]] = None,
+    binary: str = BINARY_PLACEHOLDER,
+    jobs: int = 1,
+    gitignore: Optional[GitIgnore] = None,
+    cache: Optional[TraversalCache] = None,
+    template_cache: Optional[TemplateCache] = None,
+) -> List[Change]:
+    """Changes of the folder at path with respect to what building the template
+would create in it. What the template creates is filtered with the same rules as
+the folder, after traversing it so the gitignores found there apply too. Nothing is
+written"""
+    expected = process_markdown(template, replacements, cache=template_cache)
+    if replacements:
+        _replace_contents(expected, replacements)
+    actual = build_tree(
+        path,
+        ignore_globs,
+        include_globs,
+        binary=binary,
+        jobs=jobs,
+        gitignore=gitignore,
+        cache=cache,
+    )
+    traverser = Traverser(ignore_globs, include_globs, gitignore=gitignore)
+    expected = _listed(expected, os.path.abspath(path), traverser)
+    with phase("diffing") as diffing:
+        changes = diff_structures(expected.prune(), actual)
+        diffing.add(len(changes))
+    logger.debug("%s changes between %s and %s", len(changes), template, path)
+    return changes
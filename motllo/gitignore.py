@@ -0,0 +1,194 @@
+import logging
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Pattern, Tuple
+
+logger = logging.getLogger("motllo.gitignore")
+
+
+def parse_gitignore(lines: List[str]) -> List[str]:
+    """Clean gitignore lines into patterns: no comments, blank lines or unescaped
+trailing spaces"""
+    patterns = []
+    for line in lines:
+        line = line.rstrip("\r\n")
+        while line.endswith(" ") and not line.endswith("\\ "):
+            line = line[:-1]
+        if line == "" or line.startswith("#"):
+            continue
+        patterns += [line]
+    return patterns
+
+
+def read_gitignore(path: Path) -> List[str]:
+    """Patterns of a gitignore file, none if it does not exist"""
+    if not path.exists():
+        return []
+    with path.open() as gitignore_file:
+        return parse_gitignore(gitignore_file.read().split("\n"))
+
+
+def _translate_component(component: str) -> str:
+    """Regex for a path component of a gitignore pattern. Wildcards never match a
+slash, a backslash escapes the next character"""
+    idx = 0
+    regex = []
+    while idx < len(component):
+        char = component[idx]
+        idx += 1
+        if char == "\\" and idx < len(component):
+            regex += [re.escape(component[idx])]
+            idx += 1
+        elif char == "*":
+            while idx < len(component) and component[idx] == "*":
+                idx += 1
+            regex += ["[^/]*"]
+        elif char == "?":
+            regex += ["[^/]"]
+        elif char == "[":
+            end = idx
+            if end < len(component) and component[end] in "!^":
+                end += 1
+            if end < len(component) and component[end] == "]":
+                end += 1
+            while end < len(component) and component[end] != "]":
+                end += 1
+            if end >= len(component):
+                regex += ["\\["]
+            else:
+                chars = component[idx:end].replace("\\", "\\\\")
+                idx = end + 1
+                if chars[0] in "!^":
+                    chars = "^" + chars[1:]
+                regex += [f"(?!/)[{chars}]"]
+        else:
+            regex += [re.escape(char)]
+    return "".join(regex)
+
+
+def translate(pattern: str) -> Tuple[str, bool, bool]:
+    """Convert a gitignore pattern into a regex over paths relative to the folder of
+the gitignore. Returns the regex, whether the pattern is a negation (!) and whether
+it only applies to folders (trailing slash)"""
+    negated = pattern.startswith("!")
+    if negated:
+        pattern = pattern[1:]
+    elif pattern.startswith("\\!") or pattern.startswith("\\#"):
+        pattern = pattern[1:]
+    dir_only = pattern.endswith("/")
+    pattern = pattern.rstrip("/")
+    # A slash anywhere but at the end anchors the pattern to the gitignore folder,
+    # otherwise it matches a name at any depth
+    anchored = "/" in pattern
+    components = pattern.lstrip("/").split("/")
+    regex = ""
+    for idx, component in enumerate(components):
+        last = idx == len(components) - 1
+        if component == "**":
+            if last:
+                regex += ".*" if idx == 0 else "/.*"
+            else:
+                regex += "(?:.*/)?" if idx == 0 else "/(?:.*/)?"
+            continue
+        if idx > 0 and components[idx - 1] != "**":
+            regex += "/"
+        regex += _translate_component(component)
+    if anchored:
+        return f"^{regex}\\Z", negated, dir_only
+    return f"(?:^|/){regex}\\Z", negated, dir_only
+
+
+class IgnoreRules:
+    """The patterns of one folder, compiled. Consecutive patterns with the same sign
+are merged into one alternation (one for any path, one for folders that also has
+the folder-only patterns), evaluated from the last group: the last matching pattern
+decides, as in git"""
+
+    def __init__(self, patterns: Optional[List[str]] = None):
+        self.patterns: List[str] = []
+        self._runs: List[Tuple[bool, Optional[Pattern], Optional[Pattern]]] = []
+        if patterns is not None:
+            self.extend(patterns)
+
+    def extend(self, patterns: List[str]):
+        """Adds patterns, with more priority than the ones already there"""
+        self.patterns += patterns
+        self._compile()
+        return self
+
+    def _compile(self):
+        runs: List[Tuple[bool, List[str], List[str]]] = []
+        for pattern in self.patterns:
+            regex, negated, dir_only = translate(pattern)
+            if len(runs) == 0 or runs[-1][0] != negated:
+                runs += [(negated, [], [])]
+            if not dir_only:
+                runs[-1][1].append(regex)
+            runs[-1][2].append(regex)
+        self._runs = [
+            (negated, self._alternation(any_path), self._alternation(dirs))
+            for negated, any_path, dirs in reversed(runs)
+        ]
+
+    @staticmethod
+    def _alternation(regexes: List[str]) -> Optional[Pattern]:
+        if len(regexes) == 0:
+            return None
+        return re.compile("|".join(regexes), re.DOTALL)
+
+    def match(self, relative_path: str, is_dir: bool) -> Optional[bool]:
+        """True if ignored, False if re-included by a negation, None if no pattern
+matches the path"""
+        for negated, any_path, dirs in self._runs:
+            compiled = dirs if is_dir else any_path
+            if compiled is not None and compiled.search(relative_path) is not None:
+                return not negated
+        return None
+
+
+class GitIgnore:
+    """Gitignore rules of a tree, keyed by the folder they were found in. A path is
+checked against the rules of its closest folder first, then its parents. Rules can
+be added while traversing, as each folder is entered"""
+
+    def __init__(self):
+        self._levels: Dict[str, IgnoreRules] = {}
+        self._shortest = 0
+        self._lock = threading.Lock()
+
+    def __bool__(self):
+        return len(self._levels) > 0
+
+    def add(self, base: str, patterns: List[str]):
+        """Adds patterns for the folder base, with more priority than the ones
+already added for it"""
+        if len(patterns) == 0:
+            return self
+        base = os.path.abspath(base)
+        with self._lock:
+            if base not in self._levels:
+                self._levels[base] = IgnoreRules()
+                self._shortest = min(len(level) for level in self._levels)
+            self._levels[base].extend(patterns)
+        logger.debug("Gitignore patterns for %s: %s", base, patterns)
+        return self
+
+    def ignored(self, path: str, is_dir: bool) -> bool:
+        """Whether the (absolute, normalised) path is ignored. Only the path itself is
+checked: paths inside an ignored folder are expected to have been pruned with it"""
+        base = os.path.dirname(path)
+        # No folder shorter than the shortest one with rules can have any
+        while len(base) >= self._shortest:
+            rules = self._levels.get(base)
+            if rules is not None:
+                relative = path[len(base) :].lstrip("/")
+                matched = rules.match(relative, is_dir)
+                if matched is not None:
+                    return matched
+            parent = os.path.dirname(base)
+            if parent == base:
+                break
+            base = parent
+        return False
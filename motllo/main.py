@@ -1,12 +1,22 @@
+import functools
 import logging
+import os
+import sys
 from pathlib import Path
+from typing import Dict
 
 import click
 from colorlog import ColoredFormatter  # type: ignore
 
 from motllo.build import materialise_structure, process_markdown
+from motllo.cache import TraversalCache
+from motllo.diff import diff as diff_template
+from motllo.manifest import BuildReport
 from motllo.markdown import (build_markdown, build_tree, full_gitignore,
                              text_tree, write_markdown)
+from motllo.profiling import profiling
+from motllo.template_cache import TemplateCache
+from motllo.traverser import BINARY_PLACEHOLDER, BINARY_SKIP
 
 logger = logging.getLogger("motllo")
 
@@ -32,6 +42,63 @@ def configure_logger():
     logger.addHandler(handler)
 
 
+def profile_options(command):
+    """Adds the profiling options to a command, profiling it when any is given"""
+
+    @click.option(
+        "--profile",
+        is_flag=True,
+        default=False,
+        help="Print the wall time and items handled of each phase to stderr",
+    )
+    @click.option(
+        "--profile-cprofile",
+        help="Write cProfile stats to this file, to load with pstats or snakeviz. Implies --profile",
+    )
+    @click.option(
+        "--profile-tracemalloc",
+        help="Trace memory, adding the peak of each phase, and write the top allocations to this file. Implies --profile",
+    )
+    @functools.wraps(command)
+    def profiled(*args, profile, profile_cprofile, profile_tracemalloc, **kwargs):
+        with profiling(profile, profile_cprofile, profile_tracemalloc):
+            return command(*args, **kwargs)
+
+    return profiled
+
+
+def parse_replacements(replace) -> Dict[str, str]:
+    """Replacement rules given as KEY:VALUE, by key"""
+    replacements = {}
+    for rule in replace:
+        key, value = rule.split(":")
+        replacements.update({key: value})
+    return replacements
+
+
+def open_cache(cache_dir, no_cache):
+    """Traversal cache, if a folder for it was given and it was not disabled"""
+    if cache_dir is None or no_cache:
+        return None
+    return TraversalCache(Path(cache_dir))
+
+
+# Template caches of this process, by folder
+TEMPLATE_CACHES: Dict[str, TemplateCache] = {}
+
+
+def open_template_cache(template_cache_dir):
+    """Cache of parsed templates, only if a folder for it was given explicitly: it
+holds pickles, which run code when loaded. There is one per folder in each process,
+so commands run again from the same process also reuse the templates in memory"""
+    if template_cache_dir is None:
+        return None
+    directory = os.path.abspath(template_cache_dir)
+    if directory not in TEMPLATE_CACHES:
+        TEMPLATE_CACHES[directory] = TemplateCache(directory=Path(directory))
+    return TEMPLATE_CACHES[directory]
+
+
 @click.group()
 @click.option("--debug", help="Set log level to debug", is_flag=True)
 def cli(debug):
@@ -62,6 +129,30 @@ def cli(debug):
     "--force-include",
     help='Glob patterns to forcefully include, comma separated between quotes like "*.py,*.c,*.scala"',
 )
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    default=False,
+    help="Do not use the traversal cache, even if a cache folder is set",
+)
+@click.option(
+    "--cache-dir",
+    envvar="MOTLLO_CACHE_DIR",
+    help="Folder to cache listings and file contents in, reused while they do not change. Can be set with MOTLLO_CACHE_DIR",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    help="Threads used to list folders and read files concurrently. Defaults to 1",
+    type=int,
+    default=1,
+)
+@click.option(
+    "--binary",
+    type=click.Choice([BINARY_PLACEHOLDER, BINARY_SKIP]),
+    default=BINARY_PLACEHOLDER,
+    help="Binary files get a placeholder instead of their contents, or are skipped altogether. Placeholder by default",
+)
 @click.option("-o", "--output", help="Destination markdown file", required=True)
 @click.option(
     "-x",
@@ -71,7 +162,19 @@ def cli(debug):
     default=15,
 )
 @cli.command()
-def markdown(path, gitignore, ignore, output, max_length, force_include):
+@profile_options
+def markdown(
+    path,
+    gitignore,
+    ignore,
+    output,
+    max_length,
+    force_include,
+    binary,
+    jobs,
+    cache_dir,
+    no_cache,
+):
     """Generate a Markdown template from a folder or repository at PATH. Will
 ignore hidden files, you can use --force-include to add them"""
     ppath = Path(path)
@@ -85,17 +188,25 @@ ignore hidden files, you can use --force-include to add them"""
     else:
         include_globs = None
     if gitignore:
-        gitignore_globs = full_gitignore(ppath) + ["output"]
+        gitignore_rules = full_gitignore(Path.cwd() / ppath)
+        gitignore_globs = ["output"]
     else:
+        gitignore_rules = None
         gitignore_globs = []
     all_ignore_globs = gitignore_globs + ignore_globs
     if len(all_ignore_globs) == 0:
         all_ignore_globs = None
+    cache = open_cache(cache_dir, no_cache)
     try:
         structure = build_tree(
             Path.cwd() / ppath,
             ignore_globs=all_ignore_globs,
             include_globs=include_globs,
+            max_length=max_length,
+            binary=binary,
+            jobs=jobs,
+            gitignore=gitignore_rules,
+            cache=cache,
         )
     except Exception as exc:
         logger.error("Uncaught exception building the tree: %s", exc)
@@ -103,6 +214,8 @@ ignore hidden files, you can use --force-include to add them"""
         generated_markdown = build_markdown(structure, max_length)
     except Exception as exc:
         logger.error("Uncaught exception generating the Markdown: %s", exc)
+    if cache is not None:
+        cache.close()
     try:
         write_markdown(generated_markdown, opath)
     except Exception as exc:
@@ -130,8 +243,40 @@ ignore hidden files, you can use --force-include to add them"""
 @click.option(
     "-o", "--output", help="Destination path to create everything", required=True
 )
+@click.option(
+    "-j",
+    "--jobs",
+    help="Threads used to write files concurrently, once all folders are created. Defaults to 1",
+    type=int,
+    default=1,
+)
+@click.option(
+    "--incremental",
+    is_flag=True,
+    default=False,
+    help="Build over an existing output, only rewriting files whose contents changed. A manifest of hashes is kept in the output",
+)
+@click.option(
+    "--template-cache-dir",
+    help="Folder to cache parsed templates in, reused while the template does not change. Only use a folder you trust, cached templates are pickles",
+)
+@click.option(
+    "--report",
+    help="Write a manifest of the build to this path, with the size, hash, replacements applied and time spent parsing, replacing and writing each file, and totals per phase. JSON lines if the path ends in .jsonl, JSON otherwise",
+)
 @cli.command()
-def build(path, dry_run, output, replace, ignore_existing_folders):
+@profile_options
+def build(
+    path,
+    dry_run,
+    output,
+    replace,
+    ignore_existing_folders,
+    jobs,
+    incremental,
+    report,
+    template_cache_dir,
+):
     """Build a file/folder structure based on a Markdown document at PATH"""
     ppath = Path(path)
     opath = Path(output)
@@ -140,12 +285,15 @@ def build(path, dry_run, output, replace, ignore_existing_folders):
         logger.info(
             "The following files and folders will be created, according to the replacements you may have specified"
         )
-    replacements = {}
-    for rule in replace:
-        key, value = rule.split(":")
-        replacements.update({key: value})
+    replacements = parse_replacements(replace)
+    build_report = None if report is None else BuildReport()
     try:
-        structure = process_markdown(ppath, replacements=replacements)
+        structure = process_markdown(
+            ppath,
+            replacements=replacements,
+            report=build_report,
+            cache=open_template_cache(template_cache_dir),
+        )
     except Exception as exc:
         logger.exception("Uncaught exception processing Markdown at path: %s", exc)
     try:
@@ -155,6 +303,9 @@ def build(path, dry_run, output, replace, ignore_existing_folders):
             dry_run=dry_run,
             replacements=replacements,
             ignore_existing_folders=ignore_existing_folders,
+            jobs=jobs,
+            incremental=incremental,
+            report=build_report,
         )
         if dry_run:
             logger.warning(
@@ -162,6 +313,8 @@ def build(path, dry_run, output, replace, ignore_existing_folders):
             )
     except Exception as exc:
         logger.exception("Uncaught exception materialising Markdown at path: %s", exc)
+    if build_report is not None:
+        build_report.save(Path(report))
 
 
 @click.argument("path")
@@ -178,8 +331,33 @@ def build(path, dry_run, output, replace, ignore_existing_folders):
     "--force-include",
     help='Glob patterns to forcefully include, comma separated between quotes like "*.py,*.c,*.scala"',
 )
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    default=False,
+    help="Do not use the traversal cache, even if a cache folder is set",
+)
+@click.option(
+    "--cache-dir",
+    envvar="MOTLLO_CACHE_DIR",
+    help="Folder to cache listings and file contents in, reused while they do not change. Can be set with MOTLLO_CACHE_DIR",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    help="Threads used to list folders and read files concurrently. Defaults to 1",
+    type=int,
+    default=1,
+)
+@click.option(
+    "--binary",
+    type=click.Choice([BINARY_PLACEHOLDER, BINARY_SKIP]),
+    default=BINARY_PLACEHOLDER,
+    help="Binary files get a placeholder instead of their contents, or are skipped altogether. Placeholder by default",
+)
 @cli.command()
-def tree(path, gitignore, ignore, force_include):
+@profile_options
+def tree(path, gitignore, ignore, force_include, binary, jobs, cache_dir, no_cache):
     """Generate only the visual folder tree (like the UNIX tree command)"""
     ppath = Path(path)
     if ignore is not None:
@@ -191,22 +369,131 @@ def tree(path, gitignore, ignore, force_include):
     else:
         include_globs = None
     if gitignore:
-        gitignore_globs = full_gitignore(ppath) + ["output"]
+        gitignore_rules = full_gitignore(Path.cwd() / ppath)
+        gitignore_globs = ["output"]
     else:
+        gitignore_rules = None
         gitignore_globs = []
     all_ignore_globs = gitignore_globs + ignore_globs
     if len(all_ignore_globs) == 0:
         all_ignore_globs = None
+    cache = open_cache(cache_dir, no_cache)
     try:
         only_tree = text_tree(
             Path.cwd() / ppath,
             ignore_globs=all_ignore_globs,
             include_globs=include_globs,
+            binary=binary,
+            jobs=jobs,
+            gitignore=gitignore_rules,
+            cache=cache,
         )
     except Exception as exc:
         logger.exception("Uncaught exception generating the tree: %s", exc)
+    if cache is not None:
+        cache.close()
     click.echo(only_tree)
 
 
+@click.argument("path")
+@click.argument("template")
+@click.option(
+    "-r",
+    "--replace",
+    help='Multiple replacement rules separated by colons, like -r "$PROJ:world_domination", -r"$TOOLS:python"',
+    multiple=True,
+)
+@click.option(
+    "--gitignore/--no-gitignore",
+    default=True,
+    help="Use local and global gitignores, yes by default",
+)
+@click.option(
+    "--ignore",
+    help='Glob patterns to ignore, comma separated between quotes like "*.py,*.c,*.scala"',
+)
+@click.option(
+    "--force-include",
+    help='Glob patterns to forcefully include, comma separated between quotes like ".gitignore,*.py"',
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    default=False,
+    help="Do not use the traversal cache, even if a cache folder is set",
+)
+@click.option(
+    "--cache-dir",
+    envvar="MOTLLO_CACHE_DIR",
+    help="Folder to cache listings and file contents in, reused while they do not change. Can be set with MOTLLO_CACHE_DIR",
+)
+@click.option(
+    "--template-cache-dir",
+    help="Folder to cache parsed templates in, reused while the template does not change. Only use a folder you trust, cached templates are pickles",
+)
+@click.option(
+    "-j",
+    "--jobs",
+    help="Threads used to list folders and read files concurrently. Defaults to 1",
+    type=int,
+    default=1,
+)
+@cli.command()
+@profile_options
+def diff(
+    template,
+    path,
+    replace,
+    gitignore,
+    ignore,
+    force_include,
+    jobs,
+    cache_dir,
+    no_cache,
+    template_cache_dir,
+):
+    """Compare the folder at PATH with what building the Markdown document at
+TEMPLATE would create, listing files added, removed and modified. Nothing is
+written. Hidden files are ignored, use --force-include to compare them too. Exits
+with 1 if there are differences"""
+    ppath = Path(path)
+    replacements = parse_replacements(replace)
+    if ignore is not None:
+        ignore_globs = ignore.split(",")
+    else:
+        ignore_globs = None
+    if force_include is not None:
+        include_globs = force_include.split(",")
+    else:
+        include_globs = None
+    if gitignore:
+        gitignore_rules = full_gitignore(Path.cwd() / ppath)
+    else:
+        gitignore_rules = None
+    cache = open_cache(cache_dir, no_cache)
+    try:
+        changes = diff_template(
+            Path(template),
+            Path.cwd() / ppath,
+            replacements,
+            ignore_globs=ignore_globs,
+            include_globs=include_globs,
+            jobs=jobs,
+            gitignore=gitignore_rules,
+            cache=cache,
+            template_cache=open_template_cache(template_cache_dir),
+        )
+    except Exception as exc:
+        logger.exception("Uncaught exception comparing to the template: %s", exc)
+        sys.exit(-1)
+    finally:
+        if cache is not None:
+            cache.close()
+    for change, location in changes:
+        click.echo(f"{change}: {location}")
+    if len(changes) > 0:
+        sys.exit(1)
+
+
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,141 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from motllo.atomic import write_atomically
+
+logger = logging.getLogger("motllo.manifest")
+
+MANIFEST_FILE = ".motllo-manifest.json"
+
+# Relative path of each built file to its content hash and stat when written
+Manifest = Dict[str, Dict[str, Any]]
+
+
+def content_hash(data: bytes) -> str:
+    """Hash of file contents"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def file_entry(digest: str, path: str) -> Dict[str, Any]:
+    """Manifest entry for a file with contents hashing to digest"""
+    stat = os.stat(path)
+    return {"hash": digest, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def same_stat(entry: Dict[str, Any], stat: os.stat_result) -> bool:
+    """Whether a file still looks as when its entry was recorded, so its hash can be
+trusted without reading it"""
+    return entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns
+
+
+def load_manifest(folder: str) -> Manifest:
+    """Manifest of a built folder, empty if there is none or it is unreadable"""
+    try:
+        with open(os.path.join(folder, MANIFEST_FILE)) as manifest:
+            return json.load(manifest)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as exc:
+        logger.warning("Ignoring unreadable manifest in %s: %s", folder, exc)
+        return {}
+
+
+def save_manifest(folder: str, manifest: Manifest):
+    """Write the manifest of a built folder, replacing any previous one at once"""
+    serialised = json.dumps(manifest, indent=2, sort_keys=True)
+    write_atomically(os.path.join(folder, MANIFEST_FILE), serialised)
+
+
+PHASES = ["parse", "replace", "write"]
+
+
+class BuildReport:
+    """Machine readable record of a build. For each file its path, size, content
+hash, the replacement keys applied to it and the time spent parsing, replacing and
+writing it, plus totals for each phase. Files are keyed by their path in the
+template, once replacements are applied to it"""
+
+    def __init__(self):
+        self.files: Dict[str, Dict[str, Any]] = {}
+        self.totals: Dict[str, float] = {phase: 0.0 for phase in PHASES}
+        self.locations: Dict[str, str] = {}
+        self._lock = threading.Lock()
+
+    def file(self, key: str) -> Dict[str, Any]:
+        """Entry of a file, created empty the first time"""
+        if key not in self.files:
+            self.files[key] = {
+                "path": key,
+                "bytes": 0,
+                "hash": None,
+                "replacements": [],
+                **{phase: 0.0 for phase in PHASES},
+            }
+        return self.files[key]
+
+    def rename(self, key: str, new_key: str):
+        """A file path changed once replacements were applied to it"""
+        if key in self.files and key != new_key:
+            self.files[new_key] = self.files.pop(key)
+            self.files[new_key]["path"] = new_key
+
+    def planned(self, key: str, location: str, rendered: str, keys: List[str]):
+        """A file is to be written at location with the rendered contents, once the
+replacement keys were applied"""
+        data = rendered.encode()
+        entry = self.file(key)
+        entry.update(bytes=len(data), hash=content_hash(data), replacements=keys)
+        self.locations[location] = key
+
+    def moved(self, location: str, new_location: str):
+        """A file is written somewhere else first, like a staging folder"""
+        if location in self.locations:
+            self.locations[new_location] = self.locations[location]
+
+    def add_time(self, key: Optional[str], phase: str, seconds: float):
+        """Time spent on a phase for a file. Time spent outside of any file (like
+parsing the tree) only counts towards the totals"""
+        with self._lock:
+            self.totals[phase] += seconds
+            if key is not None:
+                self.file(key)[phase] += seconds
+
+    def timed_writer(self, writer: Callable[..., Any]):
+        """Wrap a writer of files, timing each write for the file at its location"""
+
+        def timed(location: str, *args):
+            start = time.perf_counter()
+            result = writer(location, *args)
+            elapsed = time.perf_counter() - start
+            self.add_time(self.locations.get(location), "write", elapsed)
+            return result
+
+        return timed
+
+    def summary(self) -> Dict[str, Any]:
+        """Totals per phase, and of files and bytes built"""
+        built = [entry for entry in self.files.values() if entry["hash"] is not None]
+        return {
+            **self.totals,
+            "files": len(built),
+            "bytes": sum(entry["bytes"] for entry in built),
+        }
+
+    def save(self, path: Path):
+        """Write the report as JSON, or as JSON lines (one per file and a last one
+with the totals) if path ends in .jsonl"""
+        built = [entry for entry in self.files.values() if entry["hash"] is not None]
+        with path.open("w") as destination:
+            if path.suffix == ".jsonl":
+                for entry in built:
+                    destination.write(json.dumps(entry) + "\n")
+                destination.write(json.dumps({"totals": self.summary()}) + "\n")
+            else:
+                report = {"files": built, "totals": self.summary()}
+                json.dump(report, destination, indent=2)
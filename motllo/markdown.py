@@ -1,43 +1,25 @@
 from pathlib import Path
 from typing import List, Optional
 
-from motllo.ops import Folder, tree, tree_links
-from motllo.traverser import Traverser
-
-
-def gitignore(path: Path, for_path=True):
-    """Parse a gitignore to keep pathlib happy"""
-    if not path.exists():
-        return []
-    globs = []
-    with path.open() as gitignore_file:
-        lines = gitignore_file.read().split("\n")
-    clean_globs = [l for l in lines if not l.startswith("#") and l != ""]
-    globs = [f"{g}/*" if g.endswith("**") else g for g in clean_globs]
-    if for_path:
-        globs = [f"{path.parent}/{g}" for g in globs]
-    return globs
+from motllo.cache import TraversalCache
+from motllo.gitignore import GitIgnore, read_gitignore
+from motllo.ops import Folder
+from motllo.profiling import phase
+from motllo.traverser import BINARY_PLACEHOLDER, Traverser
+from motllo.tree_index import TreeIndex
 
 
 def global_gitignore():
     """Parse global gitignore"""
-    return gitignore(Path.home() / ".gitignore_global", for_path=False)
-
-
-def project_gitignore(path: Path):
-    """Parse all project gitignores (including in folders)"""
-    ignores = []
-    for item in path.iterdir():
-        if item.name == ".gitignore":
-            ignores += gitignore(item, for_path=True)
-        if item.is_dir():
-            ignores += project_gitignore(item)
-    return ignores
+    return read_gitignore(Path.home() / ".gitignore_global")
 
 
-def full_gitignore(path: Path):
-    """Combined gitignores"""
-    return project_gitignore(path) + global_gitignore()
+def full_gitignore(path: Path) -> GitIgnore:
+    """Gitignore rules to traverse path with. Only the global gitignore is read here,
+applying from path down: the Traverser adds each project gitignore when it enters
+its folder, so ignored folders are never walked"""
+    with phase("gitignore"):
+        return GitIgnore().add(str(path), global_gitignore())
 
 
 SUFFIX_TO_LANG = {
@@ -84,17 +66,16 @@ def build_file_markdown(current: Folder, base="", max_length=15):
             else:
                 basename = f"{base}/{item.name}"
             markdown += [""] + [f"# `{basename}`"]
-            if item.contents is not None:
+            lines = item.contents
+            if lines is not None:
                 markdown += [""] + [f"```{language(item.suffix)}"]
                 if item.suffix != "md":
-                    if len(item.contents) > max_length >= 0:
+                    if len(lines) > max_length >= 0 or item.truncated:
                         markdown += (
-                            item.contents[0 : max_length - 1]
-                            + [""]
-                            + [ellipsis(item.suffix)]
+                            lines[0 : max_length - 1] + [""] + [ellipsis(item.suffix)]
                         )
                     else:
-                        markdown += item.contents
+                        markdown += lines
                 else:
                     markdown += [
                         "Content from Markdown files is ignored, since the output would break parsing"
@@ -104,11 +85,37 @@ def build_file_markdown(current: Folder, base="", max_length=15):
 
 
 def build_tree(
-    path: Path, ignore_globs: Optional[List[str]], include_globs: Optional[List[str]]
+    path: Path,
+    ignore_globs: Optional[List[str]],
+    include_globs: Optional[List[str]],
+    max_length: Optional[int] = None,
+    binary: str = BINARY_PLACEHOLDER,
+    jobs: int = 1,
+    prefetch: bool = True,
+    gitignore: Optional[GitIgnore] = None,
+    cache: Optional[TraversalCache] = None,
 ):
-    """Build the tree from a path, given a glob"""
-    structure = Traverser(ignore_globs=ignore_globs, include_globs=include_globs)(path)
-    structure = structure.prune()
+    """Build the tree from a path, given a glob. File contents are only read when
+needed, and only up to max_length lines (all of them if None or negative). Binary
+files are skipped or get placeholder contents, according to binary. With more than
+one job, folders are listed (and with prefetch, files read) concurrently. Paths
+ignored by the gitignore rules are left out too. Listings and contents of paths
+that did not change are taken from the cache, if any"""
+    traverser = Traverser(
+        ignore_globs=ignore_globs,
+        include_globs=include_globs,
+        max_lines=max_length,
+        binary=binary,
+        jobs=jobs,
+        prefetch=prefetch,
+        gitignore=gitignore,
+        cache=cache,
+    )
+    with phase("traversal") as traversal:
+        structure = traverser(path)
+        traversal.add(traverser.entries)
+    with phase("pruning"):
+        structure = structure.prune()
     return structure
 
 
@@ -116,25 +123,63 @@ def text_tree(
     path: Path,
     ignore_globs: Optional[List[str]] = None,
     include_globs: Optional[List[str]] = None,
+    binary: str = BINARY_PLACEHOLDER,
+    jobs: int = 1,
+    gitignore: Optional[GitIgnore] = None,
+    cache: Optional[TraversalCache] = None,
 ):
-    """Generate the textual tree representation only"""
-    structure = build_tree(path, ignore_globs, include_globs)
-    return "\n".join(list(tree(structure)))
+    """Generate the textual tree representation only. With a single job the tree is
+listed straight into a TreeIndex, without building nodes"""
+    if jobs > 1:
+        structure = build_tree(
+            path,
+            ignore_globs,
+            include_globs,
+            binary=binary,
+            jobs=jobs,
+            prefetch=False,
+            gitignore=gitignore,
+            cache=cache,
+        )
+        index = TreeIndex.from_folder(structure)
+    else:
+        traverser = Traverser(
+            ignore_globs=ignore_globs,
+            include_globs=include_globs,
+            binary=binary,
+            gitignore=gitignore,
+            cache=cache,
+        )
+        with phase("traversal") as traversal:
+            index = traverser.index(path)
+            traversal.add(traverser.entries)
+        with phase("pruning"):
+            index = index.prune()
+    with phase("tree rendering") as rendering:
+        lines = index.tree()
+        rendering.add(len(lines))
+    return "\n".join(lines)
 
 
 def build_markdown(structure: Folder, max_length):
     """Generate markdown from a path, given ignore files"""
-    built_tree = tree(structure)
-    markdown = [""] + ["# Tree structure"]
-    markdown += [""] + ["```"] + list(built_tree) + ["```"] + [""]
-    markdown += list(tree_links(structure))
-    markdown += [""] + build_file_markdown(structure, base="", max_length=max_length)
+    with phase("tree rendering") as rendering:
+        built_tree, links = TreeIndex.from_folder(structure).render()
+        rendering.add(len(built_tree))
+    with phase("markdown rendering") as rendering:
+        markdown = [""] + ["# Tree structure"]
+        markdown += [""] + ["```"] + built_tree + ["```"] + [""]
+        markdown += links
+        markdown += [""] + build_file_markdown(
+            structure, base="", max_length=max_length
+        )
+        rendering.add(len(markdown))
     return markdown
 
 
 def write_markdown(markdown: List[str], path: Path):
-    """Write final markdown to a path"""
-    with path.open("w") as destination:
-        for line in markdown:
-            destination.write(line)
-            destination.write("\n")
+    """Write final markdown to a path, in a single call"""
+    with phase("writing") as writing, path.open("w") as destination:
+        if len(markdown) > 0:
+            destination.write("\n".join(markdown) + "\n")
+        writing.add(len(markdown))
@@ -2,7 +2,8 @@ import logging
 import re
 from abc import abstractmethod
 from dataclasses import dataclass, field
-from typing import List, Match, Optional, Pattern, Tuple
+from typing import (Dict, Iterator, List, Optional, Pattern, Sequence, TextIO,
+                    Tuple)
 
 logger = logging.getLogger("motllo.markdown_parser")
 
@@ -139,6 +140,21 @@ class ParseError(Exception):
     """Markdown ParseError"""
 
 
+REST = "(.*)"
+
+
+def without_rest(pattern: Pattern) -> Pattern:
+    """Drop the leading anchor and the trailing rest capture from a block pattern,
+so it can be matched in place at any offset of the full text. Matching the result
+at an offset consumes exactly what the original pattern consumes on the suffix"""
+    source = pattern.pattern
+    if source.startswith("^"):
+        source = source[1:]
+    if source.endswith(REST):
+        source = source[: -len(REST)]
+    return re.compile(source, pattern.flags)
+
+
 class Parser:
     """General parser stuff. It can hold an optional list of parsers, to then have
 multiple parsers (sequential, one-off) with the same interface, parse"""
@@ -150,12 +166,27 @@ multiple parsers (sequential, one-off) with the same interface, parse"""
     def parse(self, text) -> Tuple[Optional[Block], Optional[str]]:
         """Abstract parse method. Everything starts here"""
 
+    def parse_at(self, text: str, pos: int) -> Tuple[Optional[Block], int]:
+        """Parse a block starting at offset pos of text, returning the block and the
+offset where the next one starts. This default slices, parsers walking the buffer
+in place override it"""
+        block, rest = self.parse(text[pos:])
+        if block is None:
+            return None, pos
+        if rest is None:
+            return block, len(text)
+        return block, len(text) - len(rest)
+
 
 class RegexParser(Parser):
     """Parser based on a regex"""
 
     pattern: Pattern
 
+    def __init__(self, parsers: Optional[List["Parser"]] = None):
+        super().__init__(parsers)
+        self.head_pattern = without_rest(self.pattern)
+
     def parse(self, text) -> Tuple[Optional[Block], Optional[str]]:
         if text is None:
             logger.debug("Text is None in Parser")
@@ -163,11 +194,20 @@ class RegexParser(Parser):
         matching = self.pattern.match(text)
         if matching is None:
             return None, text
-        return self._map(matching)
+        rest = matching.group(matching.re.groups)
+        if rest == "":
+            rest = None
+        return self._map(matching.groups()), rest
+
+    def parse_at(self, text: str, pos: int) -> Tuple[Optional[Block], int]:
+        matching = self.head_pattern.match(text, pos)
+        if matching is None:
+            return None, pos
+        return self._map(matching.groups()), matching.end()
 
     @staticmethod
     @abstractmethod
-    def _map(matching):
+    def _map(groups: Sequence[str]) -> Block:
         pass
 
 
@@ -175,152 +215,153 @@ class CodeBlockParser(RegexParser, CodeBlock):
     """Parser for a code block"""
 
     @staticmethod
-    def _map(matching: Match) -> Tuple[Optional[CodeBlock], Optional[str]]:
-        code_block = matching.group(2)
-        language = matching.group(1)
-        rest = matching.group(3)
-        if rest == "":
-            rest = None
-        return CodeBlock(text=code_block, language=language), rest
+    def _map(groups: Sequence[str]) -> CodeBlock:
+        code_block = groups[1]
+        language = groups[0]
+        return CodeBlock(text=code_block, language=language)
 
 
 class BareCodeBlockParser(RegexParser, BareCodeBlock):
     """Parser for a code block"""
 
     @staticmethod
-    def _map(matching: Match) -> Tuple[Optional[BareCodeBlock], Optional[str]]:
-        code_block = matching.group(1)
-        rest = matching.group(2)
-        if rest == "":
-            rest = None
-        return BareCodeBlock(text=code_block), rest
+    def _map(groups: Sequence[str]) -> BareCodeBlock:
+        code_block = groups[0]
+        return BareCodeBlock(text=code_block)
 
 
 class LinkBlockParser(RegexParser, LinkBlock):
     """Parser for a link block"""
 
     @staticmethod
-    def _map(matching: Match) -> Tuple[Optional[LinkBlock], Optional[str]]:
-        title = matching.group(1)
-        link = matching.group(2)
-        rest = matching.group(3)
-        if rest == "":
-            rest = None
-        return LinkBlock(text=title, link=link), rest
+    def _map(groups: Sequence[str]) -> LinkBlock:
+        title = groups[0]
+        link = groups[1]
+        return LinkBlock(text=title, link=link)
 
 
 class ListBlockParser(RegexParser, ListBlock):
     """Parser for a single line list block"""
 
     @staticmethod
-    def _map(matching: Match) -> Tuple[Optional[ListBlock], Optional[str]]:
-        text = matching.group(1)
-        rest = matching.group(2)
-        if rest == "":
-            rest = None
-        return ListBlock(text=text), rest
+    def _map(groups: Sequence[str]) -> ListBlock:
+        text = groups[0]
+        return ListBlock(text=text)
 
 
 class NoteLinkBlockParser(RegexParser, NoteLinkBlock):
     """Parser for a link block"""
 
     @staticmethod
-    def _map(matching: Match) -> Tuple[Optional[NoteLinkBlock], Optional[str]]:
-        title = matching.group(1)
-        rest = matching.group(2)
-        if rest == "":
-            rest = None
-        return NoteLinkBlock(text=title), rest
+    def _map(groups: Sequence[str]) -> NoteLinkBlock:
+        title = groups[0]
+        return NoteLinkBlock(text=title)
 
 
 class BracketBlockParser(RegexParser, BracketBlock):
     """Parser for an image block"""
 
     @staticmethod
-    def _map(matching: Match) -> Tuple[Optional[BracketBlock], Optional[str]]:
-        link = matching.group(1)
-        rest = matching.group(2)
-        if rest == "":
-            rest = None
-        return BracketBlock(text=link), rest
+    def _map(groups: Sequence[str]) -> BracketBlock:
+        link = groups[0]
+        return BracketBlock(text=link)
 
 
 class InlinedCodeBlockParser(RegexParser, InlinedCodeBlock):
     """Parser for a code block"""
 
     @staticmethod
-    def _map(matching: Match) -> Tuple[Optional[InlinedCodeBlock], Optional[str]]:
-        code_block = matching.group(1)
-        rest = matching.group(2)
-        if rest == "":
-            rest = None
-        return InlinedCodeBlock(text=code_block), rest
+    def _map(groups: Sequence[str]) -> InlinedCodeBlock:
+        code_block = groups[0]
+        return InlinedCodeBlock(text=code_block)
 
 
 class TaskBlockParser(RegexParser, TaskBlock):
     """Parser for a code block"""
 
     @staticmethod
-    def _map(matching: Match) -> Tuple[Optional[TaskBlock], Optional[str]]:
-        code_block = matching.group(1)
-        rest = matching.group(2)
-        if rest == "":
-            rest = None
-        return TaskBlock(text=code_block), rest
+    def _map(groups: Sequence[str]) -> TaskBlock:
+        code_block = groups[0]
+        return TaskBlock(text=code_block)
 
 
 class HeadingBlockParser(RegexParser, HeadingBlock):
     """Parser for a code block"""
 
     @staticmethod
-    def _map(matching: Match) -> Tuple[Optional[HeadingBlock], Optional[str]]:
-        heading = matching.group(1)
-        rest = matching.group(2)
-        if rest == "":
-            rest = None
-        return HeadingBlock(text=heading), rest
+    def _map(groups: Sequence[str]) -> HeadingBlock:
+        heading = groups[0]
+        return HeadingBlock(text=heading)
 
 
 class TextBlockParser(RegexParser, TextBlock):
     """Parser for anything that is not a code block nor a tag, nor... Keep in mind though that tags appears only (technically) in specific contexts, and this ordering needs to be handled when processing items in order"""
 
     @staticmethod
-    def _map(matching: Match) -> Tuple[Optional[TextBlock], Optional[str]]:
-        text_block = matching.group(1)
-        rest = matching.group(2)
-        if rest == "":
-            rest = None
-        return TextBlock(text=text_block), rest
+    def _map(groups: Sequence[str]) -> TextBlock:
+        text_block = groups[0]
+        return TextBlock(text=text_block)
 
 
 class FallbackTextBlockParser(RegexParser, FallbackTextBlock):
     """Parser for broken code blocks, backticks, etc"""
 
     @staticmethod
-    def _map(matching: Match) -> Tuple[Optional[FallbackTextBlock], Optional[str]]:
-        text_block = matching.group(1)
-        rest = matching.group(2)
-        if rest == "":
-            rest = None
-        return FallbackTextBlock(text=text_block), rest
+    def _map(groups: Sequence[str]) -> FallbackTextBlock:
+        text_block = groups[0]
+        return FallbackTextBlock(text=text_block)
 
 
 class TagBlockParser(RegexParser, TagBlock):
     """Parser for a tag"""
 
     @staticmethod
-    def _map(matching: Match) -> Tuple[Optional[TagBlock], Optional[str]]:
-        tag_block = matching.group(1)
-        rest = matching.group(2)
-        if rest == "":
-            rest = None
-        return TagBlock(text=tag_block), rest
+    def _map(groups: Sequence[str]) -> TagBlock:
+        tag_block = groups[0]
+        return TagBlock(text=tag_block)
 
 
 class OrderedOneOfParser(Parser):
-    """One of a list of parsers"""
+    """One of a list of parsers. When all of them are regex based, they are also
+compiled into a single alternation, tried in the same order, so each position is
+tokenized by one regex match instead of one attempt per parser"""
+
+    def __init__(self, parsers: Optional[List[Parser]] = None):
+        super().__init__(parsers)
+        self._alternatives: Dict[str, Tuple[RegexParser, int, int]] = {}
+        self.tokenizer = self._compile_tokenizer()
+
+    def _compile_tokenizer(self) -> Optional[Pattern]:
+        """Combine the parsers into a master regex with one named group per parser.
+Alternation in a regex is ordered, so it picks the same parser as trying them in
+turn. Returns None if some parser is not regex based or flags differ"""
+        if not self.parsers:
+            return None
+        parsers = [p for p in self.parsers if isinstance(p, RegexParser)]
+        if len(parsers) != len(self.parsers):
+            return None
+        flags = {p.head_pattern.flags for p in parsers}
+        if len(flags) > 1:
+            return None
+        alternatives = []
+        group = 0
+        for idx, parser in enumerate(parsers):
+            head = parser.head_pattern
+            name = f"alternative{idx}"
+            alternatives += [f"(?P<{name}>{head.pattern})"]
+            # Groups of this parser follow the named group wrapping it
+            self._alternatives[name] = (parser, group + 1, group + 1 + head.groups)
+            group += 1 + head.groups
+        return re.compile("|".join(alternatives), flags.pop())
 
     def parse(self, text):
+        if self.tokenizer is not None and text is not None:
+            block, end = self.parse_at(text, 0)
+            if block is None:
+                return None, text
+            if end >= len(text):
+                return block, None
+            return block, text[end:]
         parsers = self.parsers
         if parsers is None:
             raise ParseError("We can't have an OrderedOneOfParser with no parsers")
@@ -331,11 +372,87 @@ class OrderedOneOfParser(Parser):
             return block, rest
         return None, text
 
+    def parse_at(self, text, pos):
+        if self.tokenizer is not None:
+            matching = self.tokenizer.match(text, pos)
+            if matching is None:
+                return None, pos
+            parser, first, last = self._alternatives[matching.lastgroup]
+            return parser._map(matching.groups()[first:last]), matching.end()
+        parsers = self.parsers
+        if parsers is None:
+            raise ParseError("We can't have an OrderedOneOfParser with no parsers")
+        for parser in parsers:
+            block, end = parser.parse_at(text, pos)
+            if block is None:
+                continue
+            return block, end
+        return None, pos
+
+
+FENCE = "```"
+CHUNK_SIZE = 1 << 16
+# Characters a TextBlock stops at
+TEXT_STOPS = "`#[-"
+WHITESPACE = re.compile(r"\s")
+# A blank line (at the start of the text or after a newline) followed by a line
+# starting with one of TEXT_STOPS
+BLANK_BEFORE_STOP = re.compile(r"(?<![^\n])[^\S\n]*\n(?=[`#[-])")
+
+
+def markdown_chunks(stream: TextIO, chunk_size: int = CHUNK_SIZE) -> Iterator[str]:
+    """Read a Markdown stream in chunks, cut after their last newline so each one
+holds whole lines"""
+    # Pieces of the line being read, only joined once its end arrives, so long
+    # lines are not copied again with each chunk
+    pending: List[str] = []
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            break
+        cut = chunk.rfind("\n") + 1
+        if cut == 0:
+            pending += [chunk]
+            continue
+        yield "".join(pending) + chunk[:cut]
+        pending = [chunk[cut:]]
+    rest = "".join(pending)
+    if rest != "":
+        yield rest
+
+
+def undecided(text: str, block: Block, start: int, end: int) -> Optional[str]:
+    """Character that, arriving after text, could change the block parsed from start
+to end, None if no later text can. Text has to end in a blank line and be followed
+by one of TEXT_STOPS: every pattern then stops before its end, but for those
+running to the next bracket, backtick or dash"""
+    if isinstance(block, TextBlock):
+        # Most blocks, which stop before any of the characters below
+        return None
+    if text.startswith(FENCE, start):
+        # Code blocks first try the longest language, up to the first whitespace,
+        # and then the contents up to the next backtick
+        space = WHITESPACE.search(text, start + len(FENCE))
+        if space is None or text.find("`", space.start()) == -1:
+            return "`"
+    if isinstance(block, FallbackTextBlock) and block.text == "[":
+        # No closing bracket yet, or a link, note link or bracket would match
+        return "]"
+    if isinstance(block, BracketBlock) and text.startswith("(", end):
+        # A link whose target has not closed yet
+        return ")"
+    if isinstance(block, ListBlock) and end == len(text):
+        # An empty list item runs over the next lines, up to a dash
+        return "-"
+    return None
+
 
 class SequenceParser(Parser):
-    """Given a parser, try to use it until exhaustion of input or impossibility to parse"""
+    """Given a parser, try to use it until exhaustion of input or impossibility to
+parse. The input is walked in place by offset, so no remainder of the text is ever
+copied and parsing is linear in the size of the document"""
 
-    def parse(self, text):
+    def _parser(self) -> Parser:
         parsers = self.parsers
         if parsers is None:
             raise ParseError("We can't sequence if there are no parsers")
@@ -343,21 +460,66 @@ class SequenceParser(Parser):
             raise ParseError(
                 "We only sequence one parser, create an OrderedOneOfParser first"
             )
-        parser = parsers[0]
-        block, rest = parser.parse(text)
-        ret = []
-        if block is not None:
-            ret = [block]
-        while rest is not None:
-            old_rest = rest
-            block, rest = parser.parse(rest)
-            if rest == old_rest:
-                err = f"No parser can process <<{rest}>>"
+        return parsers[0]
+
+    def spans(self, text) -> Iterator[Tuple[Block, int, int]]:
+        """Yield the blocks of text one by one, with the offsets they span"""
+        parser = self._parser()
+        pos = 0
+        end = len(text)
+        while True:
+            block, pos_after = parser.parse_at(text, pos)
+            if block is None:
+                err = f"No parser can process <<{text[pos:]}>>"
                 raise ParseError(err)
-            if block is not None:
-                ret += [block]
+            yield block, pos, pos_after
+            if pos_after >= end:
+                return
+            pos = pos_after
 
-        return ret, rest
+    def iterparse(self, text) -> Iterator[Block]:
+        """Yield the blocks of text one by one"""
+        for block, _, _ in self.spans(text):
+            yield block
+
+    def parse(self, text):
+        return list(self.iterparse(text)), None
+
+    def parse_stream(
+        self, stream: TextIO, chunk_size: int = CHUNK_SIZE
+    ) -> Iterator[Block]:
+        """Yield the blocks of a Markdown stream, reading it in chunks, the same as
+parsing the whole text at once. With each chunk, what was read is parsed up to its
+last blank line followed by a character a TextBlock stops at, and the blocks no
+later text can change are yielded and dropped. From the first block that can still
+change (see undecided) the text is held, and only parsed again once the character
+that can close it arrives. Only that text is in memory, a few paragraphs or a code
+block, unless a bracket or a code fence is left open"""
+        held: List[str] = []
+        closing: Optional[str] = None
+        # Whether the text read so far ends in a blank line
+        blank = False
+        for lines in markdown_chunks(stream, chunk_size):
+            cut = 0 if blank and lines[0] in TEXT_STOPS else None
+            for match in BLANK_BEFORE_STOP.finditer(lines):
+                cut = match.end()
+            if cut is not None and (closing is None or closing in lines[:cut]):
+                text = "".join(held) + lines[:cut]
+                held = []
+                for block, start, end in self.spans(text):
+                    closing = undecided(text, block, start, end)
+                    if closing is not None:
+                        held = [text[start:]]
+                        break
+                    yield block
+                lines = lines[cut:]
+            if closing is not None and closing in lines:
+                # Arrived after the cut, parse again at the next one
+                closing = None
+            held += [lines]
+            blank = lines[lines.rfind("\n", 0, -1) + 1 :].strip() == ""
+        if len(held) > 0:
+            yield from self.iterparse("".join(held))
 
     def _map(self):
         pass
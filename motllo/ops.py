@@ -1,8 +1,39 @@
-from typing import Any, Dict, List, Optional
+import hashlib
+import io
+import sys
+from typing import Any, Callable, Dict, List, Optional
 
 
 class Node:
-    """Just to make mypy happy"""
+    """Just to make mypy happy. Nodes use slots, a large tree holds hundreds of
+thousands of them.
+
+Nodes are equal when they have the same Merkle hash: of the name and contents of a
+file, or of the name and children hashes of a folder. It is computed when first
+needed and cached, and changes to a node drop its hash and those of the folders
+above it"""
+
+    __slots__ = ("_merkle", "_parent")
+
+    _merkle: Optional[bytes]
+    _parent: Optional["Folder"]
+
+    def _invalidate(self):
+        node = self
+        # A cached hash implies cached hashes below, so an uncached one means the
+        # folders above are not cached either
+        while node is not None and node._merkle is not None:
+            node._merkle = None
+            node = node._parent
+
+    def __eq__(self, other):
+        if not isinstance(other, Node):
+            return str(self) == str(other)
+        return self.merkle == other.merkle
+
+    # Nodes change in place, and hashing one would read its contents, so they are
+    # not hashable. Key by their merkle hash instead
+    __hash__ = None  # type: ignore
 
 
 class Contents:
@@ -10,10 +41,20 @@ class Contents:
 
     def __init__(self, contents=None):
         self.contents = contents
+        self._stream: Optional[io.StringIO] = None
+
+    def read(self, size=-1):
+        """Just returns the contents, or their first size characters"""
+        joined = "\n".join(self.contents)
+        if size < 0:
+            return joined
+        return joined[:size]
 
-    def read(self):
-        """Just returns the contents"""
-        return "\n".join(self.contents)
+    def readline(self, size=-1):
+        """Returns the next line, like a text file would"""
+        if self._stream is None:
+            self._stream = io.StringIO(self.read())
+        return self._stream.readline(size)
 
     def __enter__(self):
         return self
@@ -23,28 +64,44 @@ class Contents:
 
 
 class File(Node):
-    """Simulated File node, mimicking the API from Path needed to test and process a tree"""
+    """Simulated File node, mimicking the API from Path needed to test and process a
+tree. Contents are kept as a single string, and only split in lines when asked for.
+The basename (the folder of the file) is interned, all files of a folder share it"""
+
+    __slots__ = (
+        "name",
+        "basename",
+        "_contents",
+        "_loader",
+        "truncated",
+        "replacements",
+    )
 
     EMPTY_CONTENTS = "This file is empty, mode was {mode}"
 
     def __init__(
         self, path, basename="", replacements: Optional[List[Dict[str, str]]] = None
     ):
-        self._path = ""
+        self._merkle: Optional[bytes] = None
+        self._parent: Optional[Folder] = None
         self.name = ""
         self._rename(path)
-        self.contents: Optional[List[str]] = None
+        self._contents: Optional[str] = None
+        self._loader: Optional[Callable[[], str]] = None
+        self.truncated = False
         self.replacements = replacements
-        splitted = self.name.split(".")
-        if len(splitted) < 2:
-            self.suffix = None
-        else:
-            self.suffix = splitted[-1]
-        self.basename = basename
+        self.basename = sys.intern(basename)
 
     def _rename(self, path):
-        self._path = path
         self.name = path
+        self._invalidate()
+
+    @property
+    def suffix(self) -> Optional[str]:
+        """Text after the last dot of the name, None if there is no dot"""
+        if "." not in self.name:
+            return None
+        return self.name.rsplit(".", 1)[1]
 
     def as_posix(self):
         """Not really posix, but useful to generate links in the markdown result"""
@@ -58,9 +115,34 @@ class File(Node):
             return Contents(contents=[self.EMPTY_CONTENTS.format(mode=mode)])
         return Contents(contents=self.contents)
 
+    @property
+    def text(self) -> Optional[str]:
+        """Contents of the file. If a loader was set, it is only called now"""
+        if self._loader is not None:
+            loader = self._loader
+            self._loader = None
+            self.set_contents(loader())
+        return self._contents
+
+    @property
+    def contents(self) -> Optional[List[str]]:
+        """Lines of the file, split from its text on each access"""
+        text = self.text
+        if text is None:
+            return None
+        return text.split("\n")
+
     def set_contents(self, contents):
-        """Adds content as lines"""
-        self.contents = contents.strip().split("\n")
+        """Adds content, stripped"""
+        self._loader = None
+        self._contents = contents.strip()
+        self._invalidate()
+        return self
+
+    def set_loader(self, loader: Callable[[], str]):
+        """Defers reading the contents until they are first needed"""
+        self._loader = loader
+        self._invalidate()
         return self
 
     def set_replacements(self, replacements):
@@ -73,19 +155,41 @@ class File(Node):
         """What do you think this is"""
         return False
 
+    @property
+    def merkle(self) -> bytes:
+        """Hash of the name and contents"""
+        if self._merkle is None:
+            digest = hashlib.blake2b(b"file\0", digest_size=16)
+            digest.update(self.name.encode(errors="surrogatepass"))
+            text = self.text
+            if text is not None:
+                digest.update(b"\0" + text.encode(errors="surrogatepass"))
+            self._merkle = digest.digest()
+        return self._merkle
+
     def __repr__(self):
         return f"{self.name}({self.contents})"
 
-    def __eq__(self, other):
-        return str(self) == str(other)
-
 
 class Folder(Node):
     """Simulated File node, mimicking the API from Path needed to test and process a tree"""
 
+    __slots__ = (
+        "_depth",
+        "_basename",
+        "basename",
+        "name",
+        "_contents",
+    )
+
+    _contents: List[Any]
+
+    suffix = ""
+
     def __init__(self, path, contents: List[Any] = None, depth=0, basename=""):
+        self._merkle: Optional[bytes] = None
+        self._parent: Optional[Folder] = None
         self._depth = depth
-        self._path = ""
         self._basename = basename
         self.basename = ""
         self.name = ""
@@ -94,15 +198,27 @@ class Folder(Node):
             self._contents = []
         else:
             self._contents = contents
-        self.suffix = ""
+        for item in self._contents:
+            item._parent = self
 
     def _rename(self, path):
-        self._path = path
         self.name = path
         if self._basename == "":
-            self.basename = path
+            self.basename = sys.intern(path)
         else:
-            self.basename = self._basename + "/" + path
+            self.basename = sys.intern(self._basename + "/" + path)
+        self._invalidate()
+
+    @property
+    def merkle(self) -> bytes:
+        """Hash of the name and the hashes of the contents, in order"""
+        if self._merkle is None:
+            digest = hashlib.blake2b(b"folder\0", digest_size=16)
+            digest.update(self.name.encode(errors="surrogatepass") + b"\0")
+            for item in self._contents:
+                digest.update(item.merkle)
+            self._merkle = digest.digest()
+        return self._merkle
 
     def __repr__(self):
         return self.name + f"[{self.iterdir()}]"
@@ -114,15 +230,20 @@ class Folder(Node):
     def append_to_contents(self, node: Node):
         """Adds files or folders to a folder"""
         self._contents += [node]
+        node._parent = self
+        self._invalidate()
 
     def prune(self):
         """Removes empty folders"""
         for item in self.iterdir():
             if item.is_dir():
                 item.prune()
-        self._contents = list(
+        pruned = list(
             filter(lambda x: not (x.is_dir() and x.is_empty()), self._contents)
         )
+        if len(pruned) != len(self._contents):
+            self._contents = pruned
+            self._invalidate()
         return self
 
     def is_empty(self):
@@ -138,9 +259,6 @@ class Folder(Node):
         """Returns the contents so we can iterate inside"""
         return self._contents
 
-    def __eq__(self, other):
-        return str(self) == str(other)
-
 
 SPACE = "    "
 BRANCH = "│   "
@@ -0,0 +1,156 @@
+import cProfile
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Dict, List, Optional, TextIO
+
+MIB = 1024 * 1024
+TOP_ALLOCATIONS = 25
+
+
+class Phase:
+    """Wall time, calls, items handled (files, blocks, lines...) and peak traced
+memory of a phase, None when memory was not traced"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.seconds = 0.0
+        self.items = 0
+        self.peak: Optional[int] = None
+
+    def add(self, items: int = 1):
+        """Count items handled in this phase"""
+        self.items += items
+
+
+class _Ignored(Phase):
+    def add(self, items: int = 1):
+        pass
+
+
+IGNORED = _Ignored("ignored")
+
+
+class Profiler:
+    """Records phases of a run. Disabled it does nothing, so phases can be marked
+everywhere and only cost something when profiling. Phases marked with phase() also
+get the peak memory while they ran (when tracemalloc is tracing). Phases that
+happen in small steps, interleaved with others or in threads are accumulated with
+add() instead"""
+
+    def __init__(self):
+        self.enabled = False
+        self.phases: Dict[str, Phase] = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        self.phases = {}
+        self.enabled = True
+
+    def stop(self):
+        self.enabled = False
+
+    def _phase(self, name: str) -> Phase:
+        if name not in self.phases:
+            self.phases[name] = Phase(name)
+        return self.phases[name]
+
+    @contextmanager
+    def phase(self, name: str):
+        """Time what runs inside as the phase name, yielding it to count items"""
+        if not self.enabled:
+            yield IGNORED
+            return
+        with self._lock:
+            phase = self._phase(name)
+        tracing = tracemalloc.is_tracing()
+        if tracing and hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        start = time.perf_counter()
+        try:
+            yield phase
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                phase.calls += 1
+                phase.seconds += elapsed
+                if tracing:
+                    peak = tracemalloc.get_traced_memory()[1]
+                    phase.peak = max(phase.peak or 0, peak)
+
+    def add(self, name: str, seconds: float, items: int = 1):
+        """Accumulate a step of the phase name"""
+        if not self.enabled:
+            return
+        with self._lock:
+            phase = self._phase(name)
+            phase.calls += 1
+            phase.seconds += seconds
+            phase.items += items
+
+    def summary(self) -> List[str]:
+        """Table of phases, in the order they first happened. Peaks that were not
+traced show as n/a"""
+        lines = [
+            f"{'phase':<24}{'calls':>8}{'seconds':>10}{'items':>10}{'peak MiB':>10}"
+        ]
+        for phase in self.phases.values():
+            peak = "n/a" if phase.peak is None else f"{phase.peak / MIB:.1f}"
+            lines += [
+                f"{phase.name:<24}{phase.calls:>8}{phase.seconds:>10.4f}"
+                f"{phase.items:>10}{peak:>10}"
+            ]
+        return lines
+
+
+PROFILER = Profiler()
+phase = PROFILER.phase
+
+
+@contextmanager
+def profiling(
+    enabled: bool,
+    cprofile_output: Optional[str] = None,
+    tracemalloc_output: Optional[str] = None,
+    out: TextIO = sys.stderr,
+):
+    """Profile what runs inside, if enabled or any output is given. Phases are
+recorded and their summary written to out at the end. cProfile stats (for pstats or
+snakeviz) can be dumped to a file too. Memory is only traced, adding the peak of
+each phase, with a file to dump the top tracemalloc allocations to: tracing slows
+everything down, so it would skew the times otherwise"""
+    if not (enabled or cprofile_output or tracemalloc_output):
+        yield
+        return
+    PROFILER.start()
+    started_tracing = bool(tracemalloc_output) and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    profile = cProfile.Profile() if cprofile_output else None
+    if profile is not None:
+        profile.enable()
+    try:
+        yield
+    finally:
+        if profile is not None:
+            profile.disable()
+        if tracemalloc_output:
+            snapshot = tracemalloc.take_snapshot().filter_traces(
+                [
+                    tracemalloc.Filter(False, cProfile.__file__),
+                    tracemalloc.Filter(False, tracemalloc.__file__),
+                ]
+            )
+            with open(tracemalloc_output, "w") as destination:
+                for statistic in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]:
+                    destination.write(f"{statistic}\n")
+        if profile is not None and cprofile_output is not None:
+            profile.dump_stats(cprofile_output)
+        if started_tracing:
+            tracemalloc.stop()
+        PROFILER.stop()
+        for line in PROFILER.summary():
+            out.write(line + "\n")
@@ -0,0 +1,52 @@
+import re
+from functools import lru_cache
+from typing import Callable, Tuple
+
+# Pairs of text to find and text to replace it with, in the order they apply
+Pairs = Tuple[Tuple[str, str], ...]
+
+
+def _overlap(first: str, second: str) -> bool:
+    """Whether an occurrence of first and one of second can share characters"""
+    if first in second or second in first:
+        return True
+    for idx in range(1, min(len(first), len(second))):
+        if first.endswith(second[:idx]) or second.endswith(first[:idx]):
+            return True
+    return False
+
+
+def _independent(pairs: Pairs) -> bool:
+    """Whether replacing every pair in one scan gives the same as replacing them one
+after the other: no text to find can overlap another one, or the replacement of a
+pair applied before it"""
+    for idx, (old, _) in enumerate(pairs):
+        for previous_old, previous_new in pairs[:idx]:
+            if _overlap(previous_old, old) or _overlap(previous_new, old):
+                return False
+    return True
+
+
+def _sequential(pairs: Pairs) -> Callable[[str], str]:
+    def replace(text: str) -> str:
+        for old, new in pairs:
+            text = text.replace(old, new)
+        return text
+
+    return replace
+
+
+@lru_cache(maxsize=256)
+def compile_replacer(pairs: Pairs) -> Callable[[str], str]:
+    """Function applying all pairs to a text, left to right: each pair replaces every
+occurrence of its text in the result of the previous ones, as chained str.replace
+calls would. When no pair can affect the matches of another (the usual case) that
+is a single scan with one alternation regex, otherwise the pairs are applied one
+after the other. Compiled replacers are cached"""
+    if len(pairs) == 0:
+        return lambda text: text
+    if not _independent(pairs):
+        return _sequential(pairs)
+    mapping = dict(pairs)
+    regex = re.compile("|".join(re.escape(old) for old, _ in pairs))
+    return lambda text: regex.sub(lambda match: mapping[match.group(0)], text)
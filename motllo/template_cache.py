@@ -0,0 +1,140 @@
+import hashlib
+import logging
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+
+from motllo.atomic import write_atomically
+from motllo.cache import stamp
+
+logger = logging.getLogger("motllo.template_cache")
+
+DEFAULT_MAX_ENTRIES = 64
+# Part of every version, so entries pickled with other definitions are never loaded
+FORMAT_VERSION = 1
+
+
+class Definitions:
+    """What parsing a template finds, before any replacement: the contents and the
+replacement rules of each section (the tree being one of them) and the replacement
+keys they use"""
+
+    def __init__(
+        self,
+        file_contents: Dict[Optional[str], str],
+        file_replacements: Dict[Optional[str], Dict[str, str]],
+        required_keys: List[str],
+    ):
+        self.file_contents = file_contents
+        self.file_replacements = file_replacements
+        self.required_keys = required_keys
+
+
+# What a template is (its path or the hash of its text) and which version of it
+Key = Tuple[str, str]
+
+
+class TemplateCache:
+    """Definitions of parsed templates, so building the same template with other
+replacements does not parse it again. Templates are keyed by path and stamp
+(mtime, size and inode) or by a hash of their text, and only the last version of
+each is kept. The last max_entries templates used are kept in memory, and with a
+directory they are also pickled in it, one file per template, to be reused by other
+processes. Only point it at a folder you trust, pickles can run code when loaded"""
+
+    def __init__(
+        self, max_entries: int = DEFAULT_MAX_ENTRIES, directory: Optional[Path] = None
+    ):
+        if directory is not None:
+            directory.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[str, Definitions]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def path_key(path: Union[str, Path]) -> Key:
+        return f"path:{os.path.abspath(path)}", f"{FORMAT_VERSION}:{stamp(path)}"
+
+    @staticmethod
+    def text_key(text: str) -> Key:
+        digest = hashlib.sha256(text.encode(errors="surrogatepass")).hexdigest()
+        return f"text:{digest}", f"{FORMAT_VERSION}"
+
+    def _pickle_path(self, name: str) -> Path:
+        assert self.directory is not None
+        digest = hashlib.sha256(name.encode(errors="surrogatepass")).hexdigest()
+        return self.directory / f"{digest}.pickle"
+
+    def _remember(self, key: Key, definitions: Definitions):
+        name, version = key
+        with self._lock:
+            self._entries[name] = (version, definitions)
+            self._entries.move_to_end(name)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load(self, key: Key) -> Optional[Definitions]:
+        name, version = key
+        try:
+            with self._pickle_path(name).open("rb") as stored:
+                stored_version, definitions = pickle.load(stored)
+        except FileNotFoundError:
+            return None
+        except (
+            OSError,
+            pickle.UnpicklingError,
+            EOFError,
+            ValueError,
+            ImportError,
+            AttributeError,
+            TypeError,
+        ) as exc:
+            logger.warning("Ignoring unreadable cached template %s: %s", name, exc)
+            return None
+        if stored_version != version or not isinstance(definitions, Definitions):
+            return None
+        return definitions
+
+    def get(self, key: Key) -> Optional[Definitions]:
+        """Definitions stored for this version of a template, from memory or else
+from disk, None if there are none"""
+        name, version = key
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry[0] == version:
+                self._entries.move_to_end(name)
+                self.hits += 1
+                return entry[1]
+        definitions = None
+        if self.directory is not None:
+            definitions = self._load(key)
+        if definitions is not None:
+            self._remember(key, definitions)
+        with self._lock:
+            if definitions is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return definitions
+
+    def put(self, key: Key, definitions: Definitions):
+        """Store the definitions of a version of a template, replacing any other
+version of it, in memory and on disk if there is a directory. Pickles are written
+atomically, so other processes never load one half written"""
+        self._remember(key, definitions)
+        if self.directory is None:
+            return
+        name, version = key
+        try:
+            write_atomically(
+                str(self._pickle_path(name)),
+                pickle.dumps((version, definitions), protocol=4),
+            )
+        except OSError as exc:
+            logger.warning("Could not cache template %s on disk: %s", name, exc)
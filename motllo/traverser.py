@@ -1,8 +1,19 @@
+import codecs
 import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from functools import partial
 from pathlib import Path
-from typing import List, Optional
+from typing import Any, Callable, Dict, List, Optional, Pattern, Tuple, Union
 
+from motllo.cache import TraversalCache
+from motllo.gitignore import GitIgnore, parse_gitignore
 from motllo.ops import File, Folder
+from motllo.profiling import PROFILER
+from motllo.tree_index import TreeIndex
 
 logger = logging.getLogger("motllo.path_traverser")
 
@@ -17,51 +28,382 @@ def matches_glob(path: Path, globs: List[str]):
     return False
 
 
+def _translate_glob_part(part: str) -> str:
+    """Regex for a single path component of a glob, as fnmatch matches it"""
+    idx = 0
+    regex = []
+    while idx < len(part):
+        char = part[idx]
+        idx += 1
+        if char == "*":
+            regex += ["[^/]*"]
+        elif char == "?":
+            regex += ["[^/]"]
+        elif char == "[":
+            end = idx
+            if end < len(part) and part[end] == "!":
+                end += 1
+            if end < len(part) and part[end] == "]":
+                end += 1
+            while end < len(part) and part[end] != "]":
+                end += 1
+            if end >= len(part):
+                regex += ["\\["]
+            else:
+                chars = part[idx:end].replace("\\", "\\\\")
+                idx = end + 1
+                if chars.startswith("!"):
+                    chars = "^" + chars[1:]
+                elif chars.startswith("^"):
+                    chars = "\\" + chars
+                regex += [f"(?!/)[{chars}]"]
+        else:
+            regex += [re.escape(char)]
+    return "".join(regex)
+
+
+def compile_globs(globs: Optional[List[str]]) -> Optional[Pattern]:
+    """Compile globs into one regex that finds a path string when matches_glob would
+match it, so each path is checked by a single search. Like PurePath.match, relative
+globs match the rightmost components, absolute ones the whole path"""
+    if globs is None:
+        return None
+    alternatives = []
+    for glob in globs:
+        parts = [part for part in glob.split("/") if part not in ("", ".")]
+        if len(parts) == 0:
+            continue
+        regex = "/".join(_translate_glob_part(part) for part in parts)
+        if glob.startswith("/"):
+            alternatives += [f"^/{regex}\\Z"]
+        else:
+            alternatives += [f"(?:^|/){regex}\\Z"]
+    if len(alternatives) == 0:
+        return None
+    return re.compile("|".join(alternatives), re.DOTALL)
+
+
+def _matches(pattern: Optional[Pattern], path: str) -> bool:
+    return pattern is not None and pattern.search(path) is not None
+
+
+def _as_posix(path) -> str:
+    if isinstance(path, str):
+        return path
+    return path.as_posix()
+
+
+def _open(path, mode):
+    """Real paths are plain strings while traversing, simulated ones open themselves"""
+    if isinstance(path, str):
+        return open(path, mode)
+    return path.open(mode)
+
+
+def _size(path) -> int:
+    if isinstance(path, str):
+        return os.stat(path).st_size
+    return path.stat().st_size
+
+
+MAX_LINE_LENGTH = 4096
+SNIFF_SIZE = 8192
+
+BINARY_SKIP = "skip"
+BINARY_PLACEHOLDER = "placeholder"
+BINARY_CONTENTS = "Binary file of {size} bytes, contents not included"
+
+
+def is_binary(path: Union[str, Path]) -> bool:
+    """Sniff the first SNIFF_SIZE bytes of a file: NUL bytes or invalid UTF-8 mean it
+is binary"""
+    with _open(path, "rb") as data:
+        head = data.read(SNIFF_SIZE)
+    if isinstance(head, str):
+        # Simulated files only hold text
+        return False
+    if b"\0" in head:
+        return True
+    try:
+        # Unless the whole file fits, the sniff can cut a character in half
+        decoder = codecs.getincrementaldecoder("utf-8")()
+        decoder.decode(head, final=len(head) < SNIFF_SIZE)
+    except UnicodeDecodeError:
+        return True
+    return False
+
+
+def read_contents(
+    path: Union[str, Path], max_lines: Optional[int] = None
+) -> Tuple[str, bool]:
+    """Read a file, or when max_lines is positive, only enough of it to tell whether
+it has more than max_lines lines once stripped. Each line is then also cut at
+MAX_LINE_LENGTH characters, the rest of it skipped. Returns the contents and whether
+they were cut short"""
+    with _open(path, "r") as data:
+        if max_lines is None or max_lines < 1:
+            return data.read(), False
+        lines: List[str] = []
+        cut = False
+        while True:
+            line = data.readline(MAX_LINE_LENGTH)
+            if line == "":
+                return "".join(lines), cut
+            if len(line) == MAX_LINE_LENGTH and not line.endswith("\n"):
+                # Skip the rest of a long line, a piece at a time
+                rest = data.readline(MAX_LINE_LENGTH)
+                while rest != "" and not rest.endswith("\n"):
+                    cut = True
+                    rest = data.readline(MAX_LINE_LENGTH)
+                cut = cut or len(rest) > 1
+                line += rest[-1:]
+            if len(lines) == 0 and line.strip() == "":
+                # Leading blank lines would be stripped anyway
+                continue
+            lines += [line]
+            if len(lines) > max_lines and line.strip() != "":
+                return "".join(lines), True
+
+
+def _prefetch(node: File) -> Optional[str]:
+    """Reads the contents of a file ahead of their first use"""
+    return node.text
+
+
+# Whether the entry is a folder, its name and its path: a string for real paths, the
+# node itself for simulated ones
+Entry = Tuple[bool, str, Any]
+
+
 class Traverser:
     """Traverser of (real or simulated) folder hierarchy. Callable class, configuration is passed to the constructor"""
 
-    def __init__(self, ignore_globs=None, include_globs=None):
+    def __init__(
+        self,
+        ignore_globs=None,
+        include_globs=None,
+        max_lines=None,
+        binary=BINARY_PLACEHOLDER,
+        jobs=1,
+        prefetch=False,
+        gitignore: Optional[GitIgnore] = None,
+        cache: Optional[TraversalCache] = None,
+    ):
         self.ignore_globs = ignore_globs
         self.include_globs = include_globs
+        self._ignore = compile_globs(ignore_globs)
+        self._include = compile_globs(include_globs)
+        self.gitignore = gitignore
+        self.max_lines = max_lines
+        self.binary = binary
+        self.jobs = jobs
+        self.prefetch = prefetch
+        self.cache = cache
+        self.skipped_files = 0
+        self.skipped_bytes = 0
+        self.entries = 0
+        self._counts_lock = threading.Lock()
         self.initial_path: Optional[Path] = None
+        self._initial_as_posix = ""
 
     def __call__(self, initial_path) -> Folder:
+        base_path = self._start(initial_path)
+        name = initial_path.name
+        if self.jobs > 1:
+            structure = self._parallel_traverser(name, base_path)
+        else:
+            structure = self._traverser(name, base_path, depth=0)
+        self._log_skipped()
+        return structure
+
+    def index(self, initial_path) -> TreeIndex:
+        """Lists the hierarchy into a flat TreeIndex, with a loop instead of
+recursion and without creating nodes. Files are never read (except to detect binary
+ones when they are skipped)"""
+        base_path = self._start(initial_path)
+        index = TreeIndex(initial_path.name)
+        pending = [(0, base_path)]
+        while pending:
+            parent, path = pending.pop()
+            for is_dir, entry_name, entry_path in self._list_dir(path):
+                node = index.add(parent, entry_name, is_dir)
+                if is_dir:
+                    pending += [(node, entry_path)]
+        self._log_skipped()
+        return index
+
+    def _start(self, initial_path):
         self.initial_path = initial_path
-        return self._traverser(self.initial_path, depth=0)
-
-    def _handle_dir(self, path: Path, depth: int) -> Folder:
-        logger.debug("Found folder: %s", path.name)
-        return self._traverser(path, depth)
-
-    def _handle_file(self, path: Path, base_path: Path) -> File:
-        logger.debug("Found file: %s", path.name)
-        with path.open("r") as data:
-            try:
-                contents = data.read()
-            except Exception as exc:
-                msg = f"Could not read file {path}, {exc}"
-                logger.error(msg)
-                contents = msg
-        if self.initial_path is None:
-            initial_as_posix = ""
+        if isinstance(initial_path, (str, os.PathLike)):
+            # Real folders are walked with os.scandir, using plain absolute paths
+            base_path: Any = os.path.abspath(initial_path)
         else:
-            initial_as_posix = self.initial_path.as_posix()
-        return File(
-            path.name, basename=base_path.as_posix().replace(initial_as_posix, ""),
-        ).set_contents(contents)
-
-    def _traverser(self, base_path, depth=0):
-        tree = []
-        first_level = list(base_path.iterdir())
+            base_path = initial_path
+        self._initial_as_posix = _as_posix(base_path)
+        return base_path
+
+    def _log_skipped(self):
+        if self.skipped_files > 0:
+            logger.debug(
+                "Skipped %s binary files, %s bytes not read",
+                self.skipped_files,
+                self.skipped_bytes,
+            )
+
+    def _cached(self, kind: str, path, compute: Callable[[], Any]) -> Any:
+        """Only real paths are cached, they are the ones that are strings"""
+        if self.cache is None or not isinstance(path, str):
+            return compute()
+        return self.cache.cached(kind, path, compute)
+
+    def _is_binary(self, path) -> bool:
+        return self._cached("binary", path, lambda: is_binary(path))
+
+    def _skip_binary(self, name: str, path) -> bool:
+        if self.binary != BINARY_SKIP or not self._is_binary(path):
+            return False
+        size = _size(path)
+        logger.debug("Skipping binary file: %s (%s bytes)", name, size)
+        with self._counts_lock:
+            self.skipped_files += 1
+            self.skipped_bytes += size
+        return True
+
+    def _handle_dir(self, name: str, path, depth: int) -> Folder:
+        logger.debug("Found folder: %s", name)
+        return self._traverser(name, path, depth)
+
+    def _handle_file(self, name: str, path, base_path) -> File:
+        logger.debug("Found file: %s", name)
+        node = File(
+            name, basename=_as_posix(base_path).replace(self._initial_as_posix, ""),
+        )
+        # A partial is much smaller than a closure, and there is one per file
+        return node.set_loader(partial(self._load, node, path))
+
+    def _read(self, path) -> Tuple[str, bool]:
+        if self._is_binary(path):
+            size = _size(path)
+            logger.debug("Binary file %s, %s bytes not read", path, size)
+            return BINARY_CONTENTS.format(size=size), False
+        return read_contents(path, self.max_lines)
+
+    def _load(self, node: File, path) -> str:
+        start = time.perf_counter()
+        try:
+            kind = f"contents:{self.max_lines}"
+            contents, node.truncated = self._cached(
+                kind, path, partial(self._read, path)
+            )
+        except Exception as exc:
+            msg = f"Could not read file {path}, {exc}"
+            logger.error(msg)
+            contents = msg
+        PROFILER.add("reading", time.perf_counter() - start)
+        return contents
+
+    @staticmethod
+    def _scandir(base_path: str) -> List[Tuple[bool, str]]:
+        """os.scandir entries know whether they are folders without another stat"""
+        with os.scandir(base_path) as scanned:
+            return [(entry.is_dir(), entry.name) for entry in scanned]
+
+    def _scan(self, base_path) -> List[Entry]:
+        """All entries of a folder"""
+        if isinstance(base_path, str):
+            listing = self._cached(
+                "listing", base_path, lambda: self._scandir(base_path)
+            )
+            return [
+                (is_dir, name, os.path.join(base_path, name))
+                for is_dir, name in listing
+            ]
+        return [(path.is_dir(), path.name, path) for path in base_path.iterdir()]
+
+    def _load_gitignore(self, base_path, first_level: List[Entry]):
+        """Adds the rules of the gitignore in this folder, if any, before its entries
+are filtered"""
+        if self.gitignore is None:
+            return
+        for is_dir, name, path in first_level:
+            if name == ".gitignore" and not is_dir:
+                start = time.perf_counter()
+                with _open(path, "r") as data:
+                    patterns = parse_gitignore(data.read().split("\n"))
+                self.gitignore.add(_as_posix(base_path), patterns)
+                PROFILER.add("gitignore", time.perf_counter() - start)
+
+    def listed(self, name: str, path, is_dir: bool) -> bool:
+        """Whether an entry is listed: forcefully included, or else neither ignored
+by the globs or the gitignore rules nor hidden. Binary files are checked apart"""
+        as_posix = _as_posix(path)
+        if _matches(self._include, as_posix):
+            return True
+        if _matches(self._ignore, as_posix):
+            return False
+        if self.gitignore and self.gitignore.ignored(as_posix, is_dir):
+            return False
+        return not name.startswith(".")
+
+    def _list_dir(self, base_path) -> List[Entry]:
+        """The entries of a folder that are not ignored. Ignored and hidden folders
+are never listed"""
+        entries = []
+        first_level = self._scan(base_path)
         logger.debug("Here is the first level: %s", first_level)
-        for path in first_level:
-            if not matches_glob(path, self.include_globs):
-                if matches_glob(path, self.ignore_globs):
-                    continue
-                if path.name.startswith("."):
-                    continue
-            if path.is_dir():
-                tree += [self._handle_dir(path, depth + 1)]
+        self._load_gitignore(base_path, first_level)
+        for is_dir, name, path in first_level:
+            if not self.listed(name, path, is_dir):
+                continue
+            if is_dir or not self._skip_binary(name, path):
+                entries += [(is_dir, name, path)]
+        with self._counts_lock:
+            self.entries += len(entries)
+        return entries
+
+    def _traverser(self, name: str, base_path, depth=0):
+        tree: List[Union[File, Folder]] = []
+        for is_dir, entry_name, path in self._list_dir(base_path):
+            if is_dir:
+                tree += [self._handle_dir(entry_name, path, depth + 1)]
             else:
-                tree += [self._handle_file(path, base_path)]
-        return Folder(base_path.name, tree, depth)
+                tree += [self._handle_file(entry_name, path, base_path)]
+        return Folder(name, tree, depth)
+
+    def _parallel_traverser(self, name: str, initial_path) -> Folder:
+        """Lists folders (and with prefetch, reads files) from a pool of jobs threads.
+A folder is submitted as soon as its parent listing is done, so listings and reads
+overlap. The tree is then assembled in listing order, as the serial traversal"""
+        # Keyed by id, simulated folders are not hashable
+        children: Dict[int, List[Tuple[Entry, Optional[File]]]] = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            pending = {pool.submit(self._list_dir, initial_path): initial_path}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    base_path = pending.pop(future)
+                    listing: List[Tuple[Entry, Optional[File]]] = []
+                    children[id(base_path)] = listing
+                    for entry in future.result():
+                        is_dir, entry_name, path = entry
+                        node = None
+                        if is_dir:
+                            logger.debug("Found folder: %s", entry_name)
+                            pending[pool.submit(self._list_dir, path)] = path
+                        else:
+                            node = self._handle_file(entry_name, path, base_path)
+                            if self.prefetch:
+                                pool.submit(_prefetch, node)
+                        listing += [(entry, node)]
+            # Leaving the pool waits for any prefetch still running
+
+        def assemble(name, base_path, depth):
+            tree = []
+            for (is_dir, entry_name, path), node in children[id(base_path)]:
+                if is_dir:
+                    tree += [assemble(entry_name, path, depth + 1)]
+                else:
+                    tree += [node]
+            return Folder(name, tree, depth)
+
+        return assemble(name, initial_path, 0)
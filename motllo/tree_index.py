@@ -0,0 +1,162 @@
+from array import array
+from typing import List, Tuple
+
+from motllo.ops import BRANCH, LST, SPACE, TEE, Folder
+
+NO_NODE = -1
+
+
+def _anchor(name: str) -> str:
+    """Part of a markdown link anchor for a name, as ops.url builds them"""
+    return name.replace("/", "").replace(".", "").lower()
+
+
+class TreeIndex:
+    """Flat representation of a tree of folders and files, for large structures.
+Nodes are integers, the root being 0. Each node has an entry in the parent,
+first_child and next_sibling arrays (NO_NODE when there is none), its depth and
+whether it is a folder. Names are slices of a single string table, given by
+offsets. Nodes can be added in any order (depth first, breadth first or as folders
+are listed), children keep the order they were added in. Everything is walked
+with loops, never recursively"""
+
+    def __init__(self, name: str = ""):
+        self.parent = array("i", [NO_NODE])
+        self.first_child = array("i", [NO_NODE])
+        self.next_sibling = array("i", [NO_NODE])
+        self.depth = array("i", [0])
+        self.dirs = bytearray([1])
+        self.offsets = array("q", [0, len(name)])
+        self._last_child = array("i", [NO_NODE])
+        self._names = [name]
+        self._table = name
+
+    def __len__(self):
+        return len(self.parent)
+
+    def add(self, parent: int, name: str, is_dir: bool) -> int:
+        """Adds a node as the last child of parent, returning it"""
+        node = len(self.parent)
+        self.parent.append(parent)
+        self.first_child.append(NO_NODE)
+        self.next_sibling.append(NO_NODE)
+        self._last_child.append(NO_NODE)
+        self.depth.append(self.depth[parent] + 1)
+        self.dirs.append(1 if is_dir else 0)
+        self.offsets.append(self.offsets[-1] + len(name))
+        self._names += [name]
+        last = self._last_child[parent]
+        if last == NO_NODE:
+            self.first_child[parent] = node
+        else:
+            self.next_sibling[last] = node
+        self._last_child[parent] = node
+        return node
+
+    @property
+    def table(self) -> str:
+        """All names, one after the other. Names added since the last call are joined
+now, so adding stays cheap"""
+        if len(self._names) > 1:
+            self._table = "".join(self._names)
+            self._names = [self._table]
+        return self._table
+
+    def name(self, node: int) -> str:
+        return self.table[self.offsets[node] : self.offsets[node + 1]]
+
+    def is_dir(self, node: int) -> bool:
+        return self.dirs[node] == 1
+
+    def children(self, node: int) -> List[int]:
+        children = []
+        child = self.first_child[node]
+        while child != NO_NODE:
+            children += [child]
+            child = self.next_sibling[child]
+        return children
+
+    def preorder(self) -> List[int]:
+        """All nodes but the root, each folder before its contents"""
+        nodes = []
+        stack = [self.first_child[0]]
+        while stack:
+            node = stack.pop()
+            if node == NO_NODE:
+                continue
+            nodes += [node]
+            stack += [self.next_sibling[node], self.first_child[node]]
+        return nodes
+
+    @classmethod
+    def from_folder(cls, folder: Folder) -> "TreeIndex":
+        """Index of the structure below folder"""
+        index = cls(folder.name)
+        pending = [(0, folder)]
+        while pending:
+            parent, current = pending.pop()
+            for item in current.iterdir():
+                node = index.add(parent, item.name, item.is_dir())
+                if item.is_dir():
+                    pending += [(node, item)]
+        return index
+
+    def prune(self) -> "TreeIndex":
+        """New index without the folders that hold no files, at any depth"""
+        keep = bytearray(len(self))
+        keep[0] = 1
+        for node in range(1, len(self)):
+            if self.dirs[node] == 1:
+                continue
+            while keep[node] == 0:
+                keep[node] = 1
+                node = self.parent[node]
+        pruned = TreeIndex(self.name(0))
+        renumbered = array("i", [0]) * len(self)
+        for node in self.preorder():
+            if keep[node] == 1:
+                renumbered[node] = pruned.add(
+                    renumbered[self.parent[node]], self.name(node), self.is_dir(node)
+                )
+        return pruned
+
+    def render(self) -> Tuple[List[str], List[str]]:
+        """The box drawing tree (as ops.tree) and the list of links (as
+ops.tree_links), in a single pass. Links to files point to their path in the tree"""
+        lines = []
+        links = []
+        # Tree prefix, link indentation and anchor of the folders open at each depth
+        prefixes = [""]
+        indents = [""]
+        anchors = [""]
+        table = self.table
+        offsets, depths, dirs = self.offsets, self.depth, self.dirs
+        first_child, next_sibling = self.first_child, self.next_sibling
+        stack = [first_child[0]]
+        while stack:
+            node = stack.pop()
+            if node == NO_NODE:
+                continue
+            sibling = next_sibling[node]
+            stack += [sibling, first_child[node]]
+            depth = depths[node]
+            name = table[offsets[node] : offsets[node + 1]]
+            prefix = prefixes[depth - 1]
+            if dirs[node] == 1:
+                lines += [prefix + (TEE if sibling != NO_NODE else LST) + name]
+                links += [indents[depth - 1] + f"- `{name}`"]
+                del prefixes[depth:], indents[depth:], anchors[depth:]
+                prefixes += [prefix + (BRANCH if sibling != NO_NODE else SPACE)]
+                indents += [indents[depth - 1] + SPACE]
+                anchors += [anchors[depth - 1] + _anchor(name)]
+            else:
+                lines += [prefix + (TEE if sibling != NO_NODE else LST) + name]
+                anchor = anchors[depth - 1] + _anchor(name)
+                links += [f"{indents[depth - 1]}- [`{name}`](#{anchor})"]
+        return lines, links
+
+    def tree(self) -> List[str]:
+        return self.render()[0]
+
+    def tree_links(self) -> List[str]:
+        return self.render()[1]
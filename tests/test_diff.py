@@ -0,0 +1,99 @@
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from motllo.build import materialise_structure, process_markdown
+from motllo.diff import ADDED, MODIFIED, REMOVED, diff, diff_structures
+from motllo.main import cli
+from motllo.ops import File, Folder
+
+EXAMPLE = Path(__file__).parent.parent / "examples" / "python_cli.md"
+REPLACEMENTS = {"project_name": "motllo_test"}
+
+
+def built(tmp_path):
+    materialise_structure(
+        process_markdown(EXAMPLE, REPLACEMENTS),
+        tmp_path / "out",
+        dry_run=False,
+        replacements=REPLACEMENTS,
+    )
+    return tmp_path / "out"
+
+
+def test_built_folder_has_no_changes(tmp_path):
+    output = built(tmp_path)
+    assert diff(EXAMPLE, output, REPLACEMENTS, include_globs=[".gitignore"]) == []
+    # Without replacements the contents and the project folder differ
+    changes = {path: change for change, path in diff(EXAMPLE, output, {}, jobs=4)}
+    assert changes["motllo_test/main.py"] == ADDED
+    assert changes["PROJECT/main.py"] == REMOVED
+    assert changes["pyproject.toml"] == MODIFIED
+
+
+def test_reports_added_removed_and_modified(tmp_path):
+    output = built(tmp_path)
+    (output / "README.md").write_text("Changed\n")
+    (output / "motllo_test" / "main.py").unlink()
+    (output / "extra" / "deeper").mkdir(parents=True)
+    (output / "extra" / "deeper" / "new.py").write_text("new\n")
+    (output / "tests" / "test_version.py").unlink()
+    (output / "tests" / "test_version.py").mkdir()
+    (output / "tests" / "test_version.py" / "inside.py").write_text("")
+    before = sorted(output.rglob("*"))
+    assert diff(EXAMPLE, output, REPLACEMENTS, include_globs=[".gitignore"]) == [
+        (MODIFIED, "README.md"),
+        (ADDED, "extra/deeper/new.py"),
+        (REMOVED, "motllo_test/main.py"),
+        (REMOVED, "tests/test_version.py"),
+        (ADDED, "tests/test_version.py/inside.py"),
+    ]
+    assert sorted(output.rglob("*")) == before
+
+    runner = CliRunner()
+    result = runner.invoke(
+        cli, ["diff", str(EXAMPLE), str(output), "-r", "project_name:motllo_test"]
+    )
+    assert result.exit_code == 1
+    assert "modified: README.md" in result.output
+    (output / "README.md").unlink()
+    result = runner.invoke(cli, ["diff", str(EXAMPLE), str(output)])
+    assert "removed: README.md" in result.output
+
+
+def test_identical_subtrees_are_skipped():
+    class Opaque(Folder):
+        __slots__ = ()
+
+        def iterdir(self):
+            raise AssertionError("Identical folders should not be listed")
+
+    same = Folder("same", [File("a").set_contents("a")])
+    template = Folder("", [same, File("b").set_contents("b")])
+    skipped = Opaque("same", [File("a").set_contents("a")])
+    actual = Folder("root", [skipped, File("b").set_contents("changed")])
+    assert diff_structures(template, actual) == [(MODIFIED, "b")]
+
+
+def test_fresh_build_has_no_changes_with_default_options(tmp_path):
+    output = tmp_path / "out"
+    runner = CliRunner()
+    replace = ["-r", "project_name:motllo_test"]
+    result = runner.invoke(
+        cli, ["build", str(EXAMPLE), "-o", str(output), "--commit"] + replace
+    )
+    assert result.exit_code == 0
+    assert (output / ".gitignore").exists()
+    # Hidden files are left out of both sides, unless forcefully included
+    result = runner.invoke(cli, ["diff", str(EXAMPLE), str(output)] + replace)
+    assert result.exit_code == 0
+    assert "removed: .gitignore" not in result.output
+    (output / ".gitignore").write_text("changed\n")
+    result = runner.invoke(cli, ["diff", str(EXAMPLE), str(output)] + replace)
+    assert result.exit_code == 0
+    result = runner.invoke(
+        cli,
+        ["diff", str(EXAMPLE), str(output), "--force-include", ".gitignore"] + replace,
+    )
+    assert result.exit_code == 1
+    assert "modified: .gitignore" in result.output
@@ -0,0 +1,94 @@
+import pytest
+
+from motllo.gitignore import GitIgnore, parse_gitignore
+from motllo.markdown import full_gitignore, text_tree
+from motllo.ops import tree
+from motllo.traverser import Traverser
+
+
+ROOT = "/repo"
+
+CASES = [
+    ("*.pyc", "a/b/c.pyc", False, True),
+    ("*.pyc", "a/b/c.py", False, False),
+    ("/target", "target", True, True),
+    ("/target", "a/target", True, False),
+    ("build/", "build", True, True),
+    ("build/", "build", False, False),
+    ("build/", "a/build", True, True),
+    ("docs/*.md", "docs/index.md", False, True),
+    ("docs/*.md", "a/docs/index.md", False, False),
+    ("docs/*.md", "docs/sub/index.md", False, False),
+    ("**/foo", "foo", False, True),
+    ("**/foo", "a/b/foo", True, True),
+    ("a/**/b", "a/b", False, True),
+    ("a/**/b", "a/x/y/b", False, True),
+    ("a/**/b", "x/a/b", False, False),
+    ("logs/**", "logs/today.log", False, True),
+    ("logs/**", "logs", True, False),
+    ("fo?[a-c]", "foob", False, True),
+    ("fo?[!a-c]", "foob", False, False),
+    ("\\#file", "#file", False, True),
+    ("\\!bang", "!bang", False, True),
+]
+
+
+@pytest.mark.parametrize("pattern,path,is_dir,expected", CASES)
+def test_gitignore_patterns(pattern, path, is_dir, expected):
+    rules = GitIgnore().add(ROOT, [pattern])
+    assert rules.ignored(f"{ROOT}/{path}", is_dir) == expected
+
+
+def test_negation_and_nesting():
+    rules = GitIgnore()
+    rules.add(ROOT, ["*.log", "!keep.log", "*.txt"])
+    rules.add(f"{ROOT}/sub", ["!notes.txt", "keep.log"])
+    assert rules.ignored(f"{ROOT}/debug.log", False)
+    assert not rules.ignored(f"{ROOT}/keep.log", False)
+    assert rules.ignored(f"{ROOT}/sub/keep.log", False)
+    assert not rules.ignored(f"{ROOT}/sub/notes.txt", False)
+    assert rules.ignored(f"{ROOT}/sub/other.txt", False)
+    assert rules.ignored(f"{ROOT}/notes.txt", False)
+
+
+def test_parse_gitignore():
+    lines = ["# comment", "", "foo  ", "bar\\ ", "\\#baz", "!qux"]
+    assert parse_gitignore(lines) == ["foo", "bar\\ ", "\\#baz", "!qux"]
+
+
+def test_tree_respects_gitignore(tmp_path):
+    (tmp_path / ".gitignore").write_text("*.log\n!keep.log\nbuild/\n")
+    (tmp_path / "build").mkdir()
+    (tmp_path / "build" / "out.py").write_text("out")
+    (tmp_path / "src").mkdir()
+    (tmp_path / "src" / "build").write_text("a file named build")
+    (tmp_path / "src" / "debug.log").write_text("debug")
+    (tmp_path / "src" / "keep.log").write_text("keep")
+    lines = text_tree(tmp_path, gitignore=full_gitignore(tmp_path)).split("\n")
+    assert {line.strip("│├└─ ") for line in lines} == {"src", "build", "keep.log"}
+
+
+def test_ignored_folders_are_never_listed(tmp_path):
+    (tmp_path / ".gitignore").write_text("node_modules/\n")
+    for folder in ["node_modules/pkg", ".git/objects", "src/nested"]:
+        (tmp_path / folder).mkdir(parents=True)
+    (tmp_path / "src" / "nested" / ".gitignore").write_text("*.tmp\n")
+    (tmp_path / "src" / "nested" / "a.tmp").write_text("tmp")
+    (tmp_path / "src" / "nested" / "a.py").write_text("py")
+
+    scanned = []
+
+    class RecordingTraverser(Traverser):
+        def _scan(self, base_path):
+            scanned.append(base_path)
+            return super()._scan(base_path)
+
+    structure = RecordingTraverser(gitignore=GitIgnore())(tmp_path)
+    assert sorted(scanned) == sorted(
+        [str(tmp_path), str(tmp_path / "src"), str(tmp_path / "src" / "nested")]
+    )
+    assert [line.strip("│├└─ ") for line in tree(structure)] == [
+        "src",
+        "nested",
+        "a.py",
+    ]
@@ -1,7 +1,12 @@
 from motllo.ops import Folder, File, tree
 from motllo.markdown import build_tree, build_markdown
-from motllo.build import _process_markdown
+from motllo import build
+from motllo.build import _process_markdown, materialise_structure, process_markdown
+from motllo.manifest import MANIFEST_FILE, BuildReport
+import hashlib
+import json
 import random
+from pathlib import Path
 from string import ascii_uppercase
 import pytest
 
@@ -9,6 +14,18 @@ import pytest
 RANGE = 5
 
 
+@pytest.fixture
+def example():
+    """Template to build in the tests"""
+    return Path(__file__).parent.parent / "examples" / "python_cli.md"
+
+
+@pytest.fixture
+def replacements():
+    """Replacements the example template needs"""
+    return {"project_name": "motllo_test"}
+
+
 @pytest.mark.parametrize("execution_number", range(RANGE))
 @pytest.mark.parametrize("depth", range(RANGE))
 @pytest.mark.parametrize("width", range(RANGE))
@@ -68,3 +85,237 @@ or folders, and that they have content"""
     )
 
     assert structure == randomised
+
+
+def test_streamed_markdown_matches_in_memory(example, replacements):
+    with open(example) as markdown:
+        text = markdown.read()
+    assert process_markdown(example, replacements) == _process_markdown(
+        text, replacements
+    )
+
+
+def test_materialise_round_trip(tmp_path, example, replacements):
+    structure = process_markdown(example, replacements)
+    materialise_structure(
+        structure, tmp_path / "out", dry_run=False, replacements=replacements
+    )
+    files = {item.name: item for item in structure.iterdir()}
+    written = (tmp_path / "out" / "pyproject.toml").read_text()
+    assert written == "\n".join(files["pyproject.toml"].contents) + "\n"
+    assert (tmp_path / "out" / "motllo_test" / "main.py").exists()
+    with pytest.raises(SystemExit):
+        materialise_structure(
+            structure,
+            tmp_path / "out",
+            dry_run=False,
+            replacements=replacements,
+            ignore_existing_folders=True,
+        )
+
+
+def test_parallel_materialise(tmp_path, caplog, example, replacements):
+    for name, jobs in [("serial", 1), ("parallel", 4)]:
+        materialise_structure(
+            process_markdown(example, replacements),
+            tmp_path / name,
+            dry_run=False,
+            replacements=replacements,
+            jobs=jobs,
+        )
+    serial = sorted(
+        path.relative_to(tmp_path / "serial")
+        for path in (tmp_path / "serial").rglob("*")
+        if path.is_file()
+    )
+    assert len(serial) == 8
+    for path in serial:
+        assert (tmp_path / "serial" / path).read_text() == (
+            tmp_path / "parallel" / path
+        ).read_text()
+    # Existing files are all reported in creation order, before anything is written
+    (tmp_path / "conflict").mkdir()
+    for name in ["pylintrc", "README.md"]:
+        (tmp_path / "conflict" / name).write_text("existing")
+    with pytest.raises(SystemExit):
+        materialise_structure(
+            process_markdown(example, replacements),
+            tmp_path / "conflict",
+            dry_run=False,
+            ignore_existing_folders=True,
+            jobs=4,
+        )
+    errors = [
+        record.getMessage() for record in caplog.records if record.levelname == "ERROR"
+    ]
+    assert [error.split(" ")[1].split("/")[-1] for error in errors] == [
+        "README.md",
+        "pylintrc",
+    ]
+    assert not (tmp_path / "conflict" / "pyproject.toml").exists()
+
+
+def test_staged_materialise(tmp_path, monkeypatch, example, replacements):
+    materialise_structure(
+        process_markdown(example, replacements),
+        tmp_path / "out",
+        dry_run=False,
+        replacements=replacements,
+    )
+    assert [path.name for path in tmp_path.iterdir()] == ["out"]
+
+    def failing_write(location, text):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(build, "_write_file", failing_write)
+    with pytest.raises(SystemExit):
+        materialise_structure(
+            process_markdown(example, replacements),
+            tmp_path / "failed",
+            dry_run=False,
+            replacements=replacements,
+        )
+    assert [path.name for path in tmp_path.iterdir()] == ["out"]
+    monkeypatch.undo()
+    (tmp_path / "merged").mkdir()
+    (tmp_path / "merged" / "notes.txt").write_text("kept")
+    materialise_structure(
+        process_markdown(example, replacements),
+        tmp_path / "merged",
+        dry_run=False,
+        replacements=replacements,
+        ignore_existing_folders=True,
+    )
+    out = [path.name for path in (tmp_path / "out").iterdir()]
+    merged = [path.name for path in (tmp_path / "merged").iterdir()]
+    assert sorted(merged) == sorted(out + ["notes.txt"])
+
+    # A file appearing after the existing ones were checked is not replaced
+    (tmp_path / "raced").mkdir()
+    (tmp_path / "raced" / "pyproject.toml").write_text("kept")
+    monkeypatch.setattr(build.os.path, "lexists", build.os.path.isdir)
+    with pytest.raises(SystemExit):
+        materialise_structure(
+            process_markdown(example, replacements),
+            tmp_path / "raced",
+            dry_run=False,
+            replacements=replacements,
+            ignore_existing_folders=True,
+        )
+    assert (tmp_path / "raced" / "pyproject.toml").read_text() == "kept"
+    assert (tmp_path / "raced" / "motllo_test" / "main.py").exists()
+
+
+def test_incremental_materialise(tmp_path, example, replacements):
+    def incremental(replacements):
+        return materialise_structure(
+            process_markdown(example, replacements),
+            tmp_path / "out",
+            dry_run=False,
+            replacements=replacements,
+            incremental=True,
+            jobs=2,
+        )
+
+    counts = incremental(replacements)
+    assert counts == {"created": 8, "updated": 0, "unchanged": 0, "orphaned": 0}
+    assert (tmp_path / "out" / MANIFEST_FILE).exists()
+    assert incremental(replacements)["unchanged"] == 8
+    # Edited outside of motllo, and a file that was never built
+    (tmp_path / "out" / "pylintrc").write_text("x" * 10)
+    (tmp_path / "out" / "pylintrc").chmod(0o755)
+    (tmp_path / "out" / "notes.txt").write_text("not from the template")
+    counts = incremental(replacements)
+    assert counts == {"created": 0, "updated": 1, "unchanged": 7, "orphaned": 0}
+    assert (tmp_path / "out" / "pylintrc").stat().st_mode & 0o777 == 0o755
+    # The project folder and its files change name
+    counts = incremental({"project_name": "renamed"})
+    assert counts["created"] == 2 and counts["orphaned"] == 2
+    assert (tmp_path / "out" / "motllo_test" / "main.py").exists()
+
+
+def test_build_report(tmp_path, example, replacements):
+    report = BuildReport()
+    materialise_structure(
+        process_markdown(example, replacements, report=report),
+        tmp_path / "out",
+        dry_run=False,
+        replacements=replacements,
+        report=report,
+        jobs=2,
+    )
+    report.save(tmp_path / "report.json")
+    with open(tmp_path / "report.json") as saved:
+        built = json.load(saved)
+    files = {entry["path"]: entry for entry in built["files"]}
+    assert len(files) == built["totals"]["files"] == 8
+    main = files["motllo_test/main.py"]
+    data = (tmp_path / "out" / "motllo_test" / "main.py").read_bytes()
+    assert main["bytes"] == len(data)
+    assert main["hash"] == hashlib.sha256(data).hexdigest()
+    assert main["replacements"] == ["project_name"]
+    assert main["parse"] > 0 and main["replace"] > 0 and main["write"] > 0
+    assert built["totals"]["write"] == pytest.approx(
+        sum(entry["write"] for entry in built["files"])
+    )
+    report.save(tmp_path / "report.jsonl")
+    with open(tmp_path / "report.jsonl") as saved:
+        lines = [json.loads(line) for line in saved]
+    assert lines[:-1] == built["files"] and lines[-1] == {"totals": built["totals"]}
+
+
+def test_all_missing_sections_reported_at_once(caplog):
+    markdown = "\n".join(
+        [
+            "# Tree structure",
+            "",
+            "```",
+            "├── a.py",
+            "├── b.py",
+            "├── ./c.py",
+            "└── d.py",
+            "```",
+            "",
+            "# `a.py`",
+            "",
+            "```",
+            "a",
+            "```",
+            "",
+            "# `./d.py`",
+            "",
+            "```",
+            "d",
+            "```",
+            "",
+            "# `./a.py`",
+            "",
+            "```",
+            "a again",
+            "```",
+            "",
+            "# `e.py`",
+            "",
+            "```",
+            "e",
+            "```",
+        ]
+    )
+    with pytest.raises(Exception, match="2 files in the tree have no section"):
+        _process_markdown(markdown, replacements=None)
+    errors = [
+        record.getMessage() for record in caplog.records if record.levelname == "ERROR"
+    ]
+    assert errors == [
+        "File b.py in the tree has no section in the document",
+        "File c.py in the tree has no section in the document",
+    ]
+    warnings = [
+        record.getMessage()
+        for record in caplog.records
+        if record.levelname == "WARNING"
+    ]
+    assert warnings == [
+        "Section `e.py` is not a file in the tree, ignoring it",
+        "Sections `a.py` and `./a.py` are the same file, ignoring the first",
+    ]
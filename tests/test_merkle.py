@@ -0,0 +1,73 @@
+import pytest
+
+from motllo.ops import File, Folder
+
+
+def sample():
+    return Folder(
+        "root",
+        [
+            File("a.py").set_contents("a = 1"),
+            Folder("sub", [File("b.py").set_contents("b = 2"), Folder("empty")]),
+        ],
+    )
+
+
+def test_equality_matches_representation():
+    assert sample() == sample()
+    # Nodes change in place, so they cannot be hashed, their merkle hash can
+    with pytest.raises(TypeError):
+        hash(sample())
+    assert len({sample().merkle, sample().merkle}) == 1
+    assert File("a") != File("a").set_contents("")
+    assert File("a").set_contents("x") != Folder("a")
+    assert sample() != Folder("root", sample().iterdir()[::-1])
+    # Comparing to anything else still goes through the representation
+    assert File("a").set_contents("x") == "a(['x'])"
+
+
+def test_hashes_are_cached_and_invalidated():
+    first, second = sample(), sample()
+    assert first == second
+    sub = first.iterdir()[1]
+    inner = sub.iterdir()[0]
+    cached = first.merkle
+    assert first.merkle is cached and inner._merkle is not None
+
+    inner.set_contents("b = 3")
+    assert first._merkle is None and sub._merkle is None
+    assert first.iterdir()[0]._merkle is not None
+    assert first != second
+    second.iterdir()[1].iterdir()[0].set_contents("b = 3")
+    assert first == second
+
+    sub.iterdir()[1].append_to_contents(File("c"))
+    assert first != second
+    second.iterdir()[1].iterdir()[1].append_to_contents(File("c"))
+    assert first == second
+
+    inner._rename("renamed.py")
+    assert first != second
+
+
+def test_pruning_invalidates():
+    structure = sample()
+    before = structure.merkle
+    assert structure.prune().merkle != before
+    assert structure == Folder(
+        "root",
+        [
+            File("a.py").set_contents("a = 1"),
+            Folder("sub", [File("b.py").set_contents("b = 2")]),
+        ],
+    )
+
+
+def test_lazy_contents_are_hashed():
+    loaded = File("a.py").set_loader(lambda: "a = 1\n")
+    assert loaded == File("a.py").set_contents("a = 1")
+    structure = Folder("root", [File("a.py").set_contents("a = 1")])
+    cached = structure.merkle
+    structure.iterdir()[0].set_loader(lambda: "a = 2")
+    assert structure.merkle != cached
+    assert structure == Folder("root", [File("a.py").set_contents("a = 2")])
@@ -1,5 +1,6 @@
 from motllo.ops import Folder, File, tree
-from motllo.tree_parser import TreeParser
+from motllo import tree_parser
+from motllo.tree_parser import TREE_PREFIX, TreeParser, tokenize
 import random
 from string import ascii_uppercase
 import pytest
@@ -56,3 +57,38 @@ def test_randomised_tree_descent(execution_number, depth, width):
     print("Parsed:")
     print("\n".join([l for l in tree(parsed)]))
     assert parsed == randomised
+
+
+def test_tokenize():
+    lines = ["├── foo", "│   └── bar baz", "│       └── ── odd", "└── zzz"]
+    assert tokenize(lines) == [(0, "foo"), (1, "bar baz"), (2, "── odd"), (0, "zzz")]
+
+
+@pytest.mark.parametrize(
+    "lines", [["foo"], ["├── foo", "│       └── too deep"], ["│   └── no parent"]]
+)
+def test_malformed_tree(lines):
+    with pytest.raises(IndexError):
+        TreeParser(lines)()
+
+
+def test_tree_parser_reads_each_line_once(monkeypatch):
+    wide_and_deep = Folder(
+        "",
+        [
+            Folder(f"d{idx}", [Folder("sub", [File(f"f{idx}")]), File("g")])
+            for idx in range(2000)
+        ],
+    )
+    lines = list(tree(wide_and_deep))
+    matched = []
+
+    class Recording:
+        def match(self, line):
+            matched.append(line)
+            return TREE_PREFIX.match(line)
+
+    monkeypatch.setattr(tree_parser, "TREE_PREFIX", Recording())
+    assert TreeParser(lines)() == wide_and_deep
+    # Lines are never scanned again when folders are closed
+    assert matched == lines
@@ -1,5 +1,12 @@
+import io
+import random
+from pathlib import Path
+
 import pytest
 from motllo.markdown_parser import (
+    MARKDOWN_PARSER,
+    ONE_OF_MARKDOWN_NODE,
+    ParseError,
     InlinedCodeBlock,
     BareCodeBlock,
     BareCodeBlockParser,
@@ -16,9 +23,13 @@ from motllo.markdown_parser import (
     CodeBlock,
     TagBlock,
     InlinedCodeBlockParser,
+    HeadingBlock,
+    markdown_chunks,
 )
 from random import sample
 
+EXAMPLE = Path(__file__).parent.parent / "examples" / "python_cli.md"
+
 CODE = '\ndef hello_world():\n\t print("Hello world")\n'
 TAG = "#this/is/a/tag"
 TITLE = "This goes somewhere"
@@ -187,3 +198,132 @@ def test_parse_text_and_tag_code_block():
     assert blocks[5] == TextBlock(" " + second_text_block + "\n")
     assert blocks[6] == CodeBlock(f"\n{tag_block}\n", "foo")
     assert rest is None
+
+
+def _parse_by_remainders(text):
+    """The former remainder-slicing walk trying each parser in turn, as a reference
+    for the offset-based one and the combined tokenizer"""
+    blocks = []
+    rest = text
+    while rest is not None:
+        for parser in ONE_OF_MARKDOWN_NODE.parsers:
+            block, new_rest = parser.parse(rest)
+            if block is not None:
+                break
+        if block is None:
+            raise ParseError(f"No parser can process <<{rest}>>")
+        blocks += [block]
+        rest = new_rest
+    return blocks
+
+
+def test_offset_parse_matches_remainder_parse():
+    with open(EXAMPLE) as example:
+        text = example.read()
+    blocks, rest = MARKDOWN_PARSER.parse(text)
+    assert blocks == _parse_by_remainders(text)
+    assert rest is None
+
+
+def test_parse_walks_the_text_in_place(monkeypatch):
+    with open(EXAMPLE) as example:
+        text = example.read() * 4
+    calls = []
+    parse_at = OrderedOneOfParser.parse_at
+
+    def recording(self, parsed, pos):
+        calls.append((parsed, pos))
+        return parse_at(self, parsed, pos)
+
+    monkeypatch.setattr(OrderedOneOfParser, "parse_at", recording)
+    MARKDOWN_PARSER.parse(text)
+    assert len(calls) > 0
+    # The whole text is handed over each time, never a copy of what remains
+    assert all(parsed is text for parsed, _ in calls)
+    positions = [pos for _, pos in calls]
+    assert positions == sorted(set(positions))
+
+
+def test_chunks_of_long_lines():
+    # Each chunk of a line that never ends is kept apart until the line is joined
+    # once, carrying the line over would copy it again with every chunk
+    line = "x" * (1 << 20)
+    text = f"{line}\n\n```\n{line}\n```\n\n{line}"
+    chunks = list(markdown_chunks(io.StringIO(text), chunk_size=16))
+    assert chunks == [f"{line}\n\n```\n", f"{line}\n```\n\n", line]
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_tokenizer_picks_same_block_as_ordered_parsers(seed):
+    assert ONE_OF_MARKDOWN_NODE.tokenizer is not None
+    rng = random.Random(seed)
+    pieces = ["#", "# ", "##", "`", "```", "```py", "[", "]", "(", ")"]
+    pieces += ["[x]", "[[", "]]", "- ", "-", "\n", " ", "ab", "#tag", "."]
+    text = "".join(rng.choice(pieces) for _ in range(300))
+    try:
+        expected = _parse_by_remainders(text)
+    except ParseError:
+        with pytest.raises(ParseError):
+            MARKDOWN_PARSER.parse(text)
+        return
+    blocks, _ = MARKDOWN_PARSER.parse(text)
+    assert blocks == expected
+
+
+def _streamed(text, chunk_size):
+    try:
+        return list(MARKDOWN_PARSER.parse_stream(io.StringIO(text), chunk_size))
+    except ParseError:
+        return ParseError
+
+
+def _whole(text):
+    try:
+        return MARKDOWN_PARSER.parse(text)[0]
+    except ParseError:
+        return ParseError
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 1 << 16])
+def test_parse_stream_matches_parse(chunk_size):
+    with open(EXAMPLE) as example:
+        text = example.read()
+    assert _streamed(text, chunk_size) == _whole(text)
+    # Blocks spanning blank lines, and a code block opened by inline backticks
+    for text in [
+        "[link\n\ntext](http://x)\n",
+        "[note\n\n# not a heading\n\n]\n",
+        "- item one\n\ncontinued\n- two\n",
+        "- \n\n# Heading\n\n-\n",
+        "x = '```'\n\n# Title\n\n```python\na = 1\n```\n\n# Other\n",
+    ]:
+        assert _streamed(text, chunk_size) == _whole(text)
+
+
+@pytest.mark.parametrize("seed", range(50))
+def test_parse_stream_matches_parse_randomly(seed):
+    rng = random.Random(seed)
+    pieces = ["#", "# ", "#tag", "`", "```", "```py", "[", "]", "(", ")", "[x]"]
+    pieces += ["[[", "]]", "- ", "-", "\n", "\n\n", " \n\n", " ", "ab", "."]
+    pieces += ["\n\n#", "\n\n-", "\n\n- \n", "\n\n[", "\n\n```", "\n\n`"]
+    text = "".join(rng.choice(pieces) for _ in range(rng.randint(1, 100)))
+    for chunk_size in [1, 5, 64]:
+        assert _streamed(text, chunk_size) == _whole(text)
+
+
+def test_parse_stream_holds_a_section_at_a_time(monkeypatch):
+    section = "# `{idx}.py`\n\nSome prose.\n\n```python\nx = {idx}\n```\n\n"
+    # Inline backticks open a code block up to the next fence, as parsing the
+    # whole text does, without holding the rest of the document
+    text = "x = '```'\n\n" + "".join(section.format(idx=idx) for idx in range(1000))
+    blocks = _whole(text)
+    parsed = []
+    spans = SequenceParser.spans
+
+    def recording(self, text):
+        parsed.append(len(text))
+        return spans(self, text)
+
+    monkeypatch.setattr(SequenceParser, "spans", recording)
+    assert _streamed(text, 64) == blocks
+    assert max(parsed) < 4 * len(section)
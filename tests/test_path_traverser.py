@@ -1,4 +1,12 @@
-from motllo.traverser import Traverser
+from pathlib import Path
+
+import pytest
+
+from motllo.cache import MISSING, TraversalCache
+from motllo.markdown import build_file_markdown
+from motllo.traverser import (BINARY_CONTENTS, BINARY_PLACEHOLDER, BINARY_SKIP,
+                              MAX_LINE_LENGTH, Traverser, compile_globs,
+                              matches_glob)
 from motllo.ops import Folder, File
 
 
@@ -17,3 +25,137 @@ def test_traverse_path():
     )
     traversed = Traverser()(mbp)
     assert traversed == mbp
+
+
+@pytest.mark.parametrize("max_length", [0, 1, 15, 99, 100, 101])
+def test_bounded_read_renders_like_full_read(tmp_path, max_length):
+    lines = ["", "  "] + [f"line {i}" for i in range(98)] + ["", ""]
+    (tmp_path / "long.py").write_text("\n".join(lines))
+    (tmp_path / "short.py").write_text("one\ntwo\n")
+    full = build_file_markdown(Traverser()(tmp_path), max_length=max_length)
+    bounded = Traverser(max_lines=max_length)(tmp_path)
+    assert build_file_markdown(bounded, max_length=max_length) == full
+
+
+def test_bounded_read_cuts_each_line(tmp_path):
+    long = "x" * (3 * MAX_LINE_LENGTH + 1)
+    (tmp_path / "long.py").write_text(f"{long}\none\n{long}\ntwo\n")
+    (tmp_path / "exact.py").write_text("y" * MAX_LINE_LENGTH)
+    files = {item.name: item for item in Traverser(max_lines=5)(tmp_path).iterdir()}
+    short = "x" * MAX_LINE_LENGTH
+    assert files["long.py"].contents == [short, "one", short, "two"]
+    assert files["long.py"].truncated
+    assert files["exact.py"].contents == ["y" * MAX_LINE_LENGTH]
+    assert not files["exact.py"].truncated
+
+
+def test_contents_are_read_lazily(tmp_path):
+    (tmp_path / "foo.py").write_text("foo")
+    traversed = Traverser(max_lines=15)(tmp_path)
+    (tmp_path / "foo.py").write_text("bar")
+    assert traversed.iterdir()[0].contents == ["bar"]
+
+
+def test_binary_files(tmp_path):
+    (tmp_path / "text.py").write_text("print('hello')")
+    (tmp_path / "image.gif").write_bytes(b"GIF89a\x00\x01\x02" * 100)
+    (tmp_path / "latin.txt").write_bytes("caf\xe9".encode("latin-1"))
+
+    skipping = Traverser(binary=BINARY_SKIP)
+    names = [item.name for item in skipping(tmp_path).iterdir()]
+    assert sorted(names) == ["text.py"]
+    assert skipping.skipped_files == 2
+    assert skipping.skipped_bytes == 904
+
+    placeholders = {
+        item.name: item.contents
+        for item in Traverser(binary=BINARY_PLACEHOLDER)(tmp_path).iterdir()
+    }
+    assert placeholders["image.gif"] == [BINARY_CONTENTS.format(size=900)]
+    assert placeholders["text.py"] == ["print('hello')"]
+
+
+@pytest.mark.parametrize("jobs", [2, 8])
+def test_parallel_traverse_matches_serial(tmp_path, jobs):
+    for folder in ["a", "a/b", "a/b/c", "d", "e"]:
+        (tmp_path / folder).mkdir()
+        for idx in range(5):
+            (tmp_path / folder / f"file{idx}.py").write_text(f"{folder} {idx}")
+    serial = Traverser(max_lines=15)(tmp_path)
+    parallel = Traverser(max_lines=15, jobs=jobs, prefetch=True)(tmp_path)
+    assert parallel == serial
+    assert repr(parallel) == repr(serial)
+
+    simulated = Folder("base", [File("foo"), Folder("bar", [File("baz")])])
+    assert Traverser(jobs=jobs)(simulated) == Traverser()(simulated)
+
+
+def test_compiled_globs_match_like_pathlib():
+    globs = ["*.pyc", "build", "docs/*.md", "/abs/path/*", "./local", "[!a]?x", "**/c"]
+    compiled = compile_globs(globs)
+    paths = [
+        "/repo/foo.pyc",
+        "/repo/foo.py",
+        "/repo/build",
+        "/repo/builder",
+        "/repo/docs/index.md",
+        "/repo/other/index.md",
+        "/abs/path/file",
+        "/abs/path/deeper/file",
+        "/repo/abs/path/file",
+        "/repo/local",
+        "/repo/bzx",
+        "/repo/abx",
+        "/repo/b/c",
+        "relative/docs/a.md",
+    ]
+    for path in paths:
+        assert (compiled.search(path) is not None) == matches_glob(Path(path), globs)
+
+
+def test_traversal_cache(tmp_path):
+    source = tmp_path / "source"
+    (source / "sub").mkdir(parents=True)
+    (source / "foo.py").write_text("foo")
+    (source / "sub" / "bar.py").write_text("bar")
+
+    def traverse(cache):
+        structure = Traverser(max_lines=15, cache=cache)(source)
+        build_file_markdown(structure)
+        return structure
+
+    with TraversalCache(tmp_path / "cache") as cache:
+        first = traverse(cache)
+        # Listings, contents and binary sniffs
+        assert (cache.hits, cache.misses) == (0, 6)
+    with TraversalCache(tmp_path / "cache") as cache:
+        assert traverse(cache) == first
+        assert (cache.hits, cache.misses) == (4, 0)
+        (source / "foo.py").write_text("changed")
+        files = {item.name: item for item in traverse(cache).iterdir()}
+        assert files["foo.py"].contents == ["changed"]
+
+
+def test_traversal_cache_evicts_least_recently_used(tmp_path):
+    with TraversalCache(tmp_path, max_bytes=50) as cache:
+        cache.put("old", "stamp", "x" * 20)
+        cache.put("new", "stamp", "y" * 20)
+        cache.put("newest", "stamp", "z" * 20)
+    with TraversalCache(tmp_path) as cache:
+        assert cache.get("old", "stamp") is MISSING
+        assert cache.get("newest", "stamp") == "z" * 20
+
+
+def test_compact_nodes(tmp_path):
+    for name in ["a.py", "b.py"]:
+        (tmp_path / "sub" / "deep").mkdir(parents=True, exist_ok=True)
+        (tmp_path / "sub" / "deep" / name).write_text("\nfirst\nsecond\n\n")
+    traversed = Traverser()(tmp_path)
+    first, second = traversed.iterdir()[0].iterdir()[0].iterdir()
+    assert not hasattr(first, "__dict__") and not hasattr(traversed, "__dict__")
+    # Files of a folder share their basename
+    assert first.basename is second.basename == "/sub/deep"
+    assert first.as_posix() == "/sub/deep/a.py"
+    assert first.suffix == "py" and File("Makefile").suffix is None
+    assert first.text == "first\nsecond"
+    assert first.contents == ["first", "second"]
@@ -0,0 +1,69 @@
+import io
+import pstats
+import tracemalloc
+
+import pytest
+
+from motllo.markdown import text_tree
+from motllo.ops import File, Folder
+from motllo.profiling import PROFILER, Profiler, profiling
+
+
+def structure():
+    return Folder(
+        "",
+        [
+            File("a.py").set_contents("a"),
+            Folder("sub", [File("b.py").set_contents("b")], depth=1),
+        ],
+    )
+
+
+@pytest.fixture
+def profiler():
+    """The global profiler, without the phases other tests left in it"""
+    PROFILER.phases = {}
+    yield PROFILER
+    PROFILER.phases = {}
+
+
+def test_disabled_profiler_records_nothing(profiler):
+    text_tree(structure())
+    assert profiler.phases == {}
+    fresh = Profiler()
+    with fresh.phase("parsing") as parsing:
+        parsing.add(3)
+    fresh.add("reading", 0.5)
+    assert fresh.phases == {}
+
+
+def test_profiling_summary(tmp_path, profiler):
+    out = io.StringIO()
+    stats = tmp_path / "stats.prof"
+    allocations = tmp_path / "allocations.txt"
+    with profiling(False, str(stats), str(allocations), out=out):
+        text_tree(structure())
+    assert not profiler.enabled
+    traversal = profiler.phases["traversal"]
+    assert traversal.calls == 1 and traversal.items == 3
+    assert traversal.peak is not None
+    summary = out.getvalue().split("\n")
+    assert summary[0].split() == ["phase", "calls", "seconds", "items", "peak", "MiB"]
+    assert [line[:24].strip() for line in summary[1:] if line != ""] == [
+        "traversal",
+        "pruning",
+        "tree rendering",
+    ]
+    assert pstats.Stats(str(stats)).total_calls > 0
+    assert allocations.read_text() != ""
+
+
+def test_profiling_without_tracemalloc_output(profiler):
+    out = io.StringIO()
+    with profiling(True, out=out):
+        assert not tracemalloc.is_tracing()
+        text_tree(structure())
+    assert profiler.phases["traversal"].peak is None
+    summary = out.getvalue().split("\n")
+    assert summary[1].split()[0] == "traversal"
+    assert summary[1].split()[-1] == "n/a"
@@ -0,0 +1,51 @@
+import random
+
+import pytest
+
+from motllo.build import replace_replacements
+from motllo.replacer import _independent, compile_replacer
+
+
+def chained(pairs, text):
+    for old, new in pairs:
+        text = text.replace(old, new)
+    return text
+
+
+def test_replaces_all_keys():
+    file_replacement = {"project": "PROJECT", "tool": "$TOOL", "unused": "nothing"}
+    replacements = {"project": "motllo", "tool": "python", "other": "ignored"}
+    text = "PROJECT uses $TOOL\nimport PROJECT"
+    assert replace_replacements(file_replacement, replacements, text) == (
+        "motllo uses python\nimport motllo"
+    )
+
+
+def test_left_to_right():
+    # A later pair sees the result of the ones before it, and not the other way round
+    pairs = (("a", "b"), ("b", "c"))
+    assert not _independent(pairs)
+    assert compile_replacer(pairs)("ab") == "cc"
+    assert compile_replacer(tuple(reversed(pairs)))("ab") == "bc"
+    # The first pair wins overlapping matches
+    pairs = (("aa", "X"), ("ab", "Y"))
+    assert compile_replacer(pairs)("aab") == "Xb"
+
+
+def test_independent_pairs_are_compiled():
+    pairs = (("PROJECT", "motllo"), ("$TOOL", "python"))
+    assert _independent(pairs)
+    assert compile_replacer(pairs) is compile_replacer(pairs)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_matches_chained_replace(seed):
+    rng = random.Random(seed)
+
+    def word(min_length=1):
+        return "".join(rng.choice("abc") for _ in range(rng.randint(min_length, 3)))
+
+    for _ in range(50):
+        pairs = tuple((word(), word(0)) for _ in range(rng.randint(0, 4)))
+        text = "".join(rng.choice("abc\n") for _ in range(rng.randint(0, 40)))
+        assert compile_replacer(pairs)(text) == chained(pairs, text)
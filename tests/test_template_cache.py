@@ -0,0 +1,120 @@
+import os
+from pathlib import Path
+
+from click.testing import CliRunner
+
+from motllo import build
+from motllo.build import _process_markdown, materialise_structure, process_markdown
+from motllo.main import cli
+from motllo.template_cache import Definitions, TemplateCache
+
+EXAMPLE = Path(__file__).parent.parent / "examples" / "python_cli.md"
+
+
+def not_parsed(*args, **kwargs):
+    raise AssertionError("A cached template should not be parsed again")
+
+
+def test_cached_definitions_match_parsing(tmp_path, monkeypatch):
+    cache = TemplateCache()
+    first = {"project_name": "first"}
+    second = {"project_name": "second"}
+    assert process_markdown(EXAMPLE, first, cache=cache) == process_markdown(
+        EXAMPLE, first
+    )
+    monkeypatch.setattr(build, "markdown_definitions", not_parsed)
+    cached = process_markdown(EXAMPLE, second, cache=cache)
+    monkeypatch.undo()
+    assert cached == process_markdown(EXAMPLE, second)
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Applying replacements leaves the cached definitions as they were
+    materialise_structure(cached, tmp_path / "out", dry_run=False, replacements=second)
+    assert process_markdown(EXAMPLE, first, cache=cache) == process_markdown(
+        EXAMPLE, first
+    )
+
+    text = EXAMPLE.read_text()
+    assert _process_markdown(text, first, cache) == _process_markdown(text, first)
+    expected = process_markdown(EXAMPLE, second)
+    monkeypatch.setattr(build, "markdown_definitions", not_parsed)
+    assert _process_markdown(text, second, cache) == expected
+
+
+def test_changed_templates_are_parsed_again(tmp_path):
+    template = tmp_path / "template.md"
+    template.write_text(EXAMPLE.read_text())
+    cache = TemplateCache()
+    replacements = {"project_name": "motllo"}
+    process_markdown(template, replacements, cache=cache)
+    template.write_text(EXAMPLE.read_text().replace("PROJECT", "PROJECTS"))
+    changed = process_markdown(template, replacements, cache=cache)
+    assert cache.misses == 2
+    assert changed == process_markdown(template, replacements)
+
+
+def test_pickled_tier(tmp_path, monkeypatch):
+    directory = tmp_path / "cache"
+    replacements = {"project_name": "motllo"}
+    process_markdown(EXAMPLE, replacements, cache=TemplateCache(directory=directory))
+    assert len(list(directory.glob("*.pickle"))) == 1
+
+    expected = process_markdown(EXAMPLE, replacements)
+    monkeypatch.setattr(build, "markdown_definitions", not_parsed)
+    other = TemplateCache(directory=directory)
+    assert process_markdown(EXAMPLE, replacements, cache=other) == expected
+    assert other.hits == 1
+    monkeypatch.undo()
+
+    # Unreadable pickles are parsed again, and replaced
+    pickled = next(directory.glob("*.pickle"))
+    pickled.write_bytes(b"not a pickle")
+    broken = TemplateCache(directory=directory)
+    process_markdown(EXAMPLE, replacements, cache=broken)
+    assert broken.misses == 1
+    assert TemplateCache(directory=directory).get(TemplateCache.path_key(EXAMPLE))
+    # Nothing staged is left behind
+    assert os.listdir(directory) == [pickled.name]
+
+
+def test_least_recently_used_are_evicted():
+    cache = TemplateCache(max_entries=2)
+    for name in ["a", "b", "a", "c"]:
+        cache.put(TemplateCache.text_key(name), Definitions({}, {}, []))
+    assert cache.get(TemplateCache.text_key("a")) is not None
+    assert cache.get(TemplateCache.text_key("c")) is not None
+    assert cache.get(TemplateCache.text_key("b")) is None
+
+
+def test_pickles_only_in_an_explicit_folder(tmp_path):
+    runner = CliRunner()
+    cache = tmp_path / "cache"
+    templates = tmp_path / "templates"
+    arguments = ["build", str(EXAMPLE), "-o", str(tmp_path / "out")]
+    result = runner.invoke(cli, arguments, env={"MOTLLO_CACHE_DIR": str(cache)})
+    assert result.exit_code == 0
+    assert not cache.exists()
+    result = runner.invoke(cli, arguments + ["--template-cache-dir", str(templates)])
+    assert result.exit_code == 0
+    assert len(list(templates.glob("*.pickle"))) == 1
+
+
+def test_cli_runs_share_the_template_cache(tmp_path, monkeypatch):
+    runner = CliRunner()
+    templates = tmp_path / "templates"
+    arguments = ["build", str(EXAMPLE), "--template-cache-dir", str(templates)]
+    parsed = []
+    parse = build.markdown_definitions
+
+    def counted(*args, **kwargs):
+        parsed.append(args)
+        return parse(*args, **kwargs)
+
+    monkeypatch.setattr(build, "markdown_definitions", counted)
+    result = runner.invoke(cli, arguments + ["-o", str(tmp_path / "first")])
+    assert result.exit_code == 0
+    # Only the memory of the cache still holds the template
+    for pickled in templates.glob("*.pickle"):
+        pickled.unlink()
+    result = runner.invoke(cli, arguments + ["-o", str(tmp_path / "second")])
+    assert result.exit_code == 0
+    assert len(parsed) == 1
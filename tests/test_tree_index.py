@@ -0,0 +1,65 @@
+import sys
+
+from motllo.markdown import text_tree
+from motllo.ops import File, Folder, tree, tree_links
+from motllo.traverser import Traverser
+from motllo.tree_index import NO_NODE, TreeIndex
+
+
+def sample(root):
+    for folder in ["a", "a/b", "a/b/c", "d", "empty", "empty/deeper", "e.f"]:
+        (root / folder).mkdir()
+    for folder in ["a", "a/b", "a/b/c", "d", "e.f"]:
+        for name in ["x.py", "Y.md", "z"]:
+            (root / folder / name).write_text(folder)
+    (root / "top.txt").write_text("top")
+
+
+def test_renders_like_recursive_tree(tmp_path):
+    sample(tmp_path)
+    structure = Traverser()(tmp_path).prune()
+    index = TreeIndex.from_folder(structure)
+    assert index.render() == (list(tree(structure)), list(tree_links(structure)))
+    assert index.name(0) == structure.name
+    assert [index.name(node) for node in index.children(0)] == [
+        item.name for item in structure.iterdir()
+    ]
+
+
+def test_traverser_index_matches_nodes(tmp_path):
+    sample(tmp_path)
+    structure = Traverser()(tmp_path)
+    index = Traverser().index(tmp_path)
+    assert index.render() == TreeIndex.from_folder(structure).render()
+    assert index.prune().render() == TreeIndex.from_folder(structure.prune()).render()
+    assert "empty" in "".join(index.tree())
+    assert "empty" not in "".join(index.prune().tree())
+    assert text_tree(tmp_path) == text_tree(tmp_path, jobs=4)
+
+
+def test_sibling_arrays():
+    index = TreeIndex("root")
+    first = index.add(0, "first", True)
+    second = index.add(0, "second", False)
+    inner = index.add(first, "inner", False)
+    assert index.first_child[0] == first and index.next_sibling[first] == second
+    assert index.next_sibling[second] == NO_NODE
+    assert index.parent[inner] == first and index.depth[inner] == 2
+    assert index.table == "rootfirstsecondinner"
+    assert index.tree() == ["├── first", "│   └── inner", "└── second"]
+
+
+def test_deep_trees_do_not_recurse():
+    depth = sys.getrecursionlimit() * 2
+    index = TreeIndex()
+    parent = 0
+    for level in range(depth):
+        parent = index.add(parent, f"level{level}", True)
+    index.add(parent, "leaf.py", False)
+    lines, links = index.prune().render()
+    assert len(lines) == len(links) == depth + 1
+    anchor = "".join(f"level{level}" for level in range(depth)) + "leafpy"
+    assert links[-1].endswith(f"(#{anchor})")
+
+    simulated = Folder("", [Folder("only", [File("file")])])
+    assert TreeIndex.from_folder(simulated).tree() == ["└── only", "    └── file"]